@@ -0,0 +1,67 @@
+from pathlib import Path
+import typer
+from wasabi import msg
+
+from results_store import ResultsStore, compare_runs
+
+
+def main(
+    result_dir: Path,
+    run_id: int = typer.Option(0, help="Run to check. Defaults to the latest run of every model."),
+    baseline_id: int = typer.Option(0, help="Run to compare against, requires --run-id. Defaults to the previous run with the same configuration."),
+    threshold: float = typer.Option(0.05, help="Relative change for the worse that counts as a regression."),
+):
+    """Compare benchmark runs stored in results.sqlite against a baseline and
+    flag throughput, latency and memory regressions above the threshold. Exits
+    with status 1 if any regression was found."""
+    if baseline_id and not run_id:
+        msg.fail("--baseline-id requires --run-id, since a baseline only applies to one model and configuration", exits=1)
+    store = ResultsStore(result_dir / "results.sqlite")
+    if run_id:
+        run = store.get_run(run_id)
+        if run is None:
+            msg.fail(f"Run {run_id} not found in {store.path}", exits=1)
+        runs = [run]
+    else:
+        runs = store.latest_runs()
+    regressions = 0
+    for run in runs:
+        baseline = store.get_run(baseline_id) if baseline_id else store.baseline(run)
+        label = f"run {run['id']}: {run['library']} {run['name']} (GPU={bool(run['gpu'])})"
+        if baseline is None:
+            msg.info(f"No baseline for {label}")
+            continue
+        msg.divider(f"{label} vs. run {baseline['id']}")
+        _warn_differences(run, baseline)
+        rows = []
+        for comparison in compare_runs(run, baseline, threshold):
+            regressions += comparison["regression"]
+            rows.append(
+                (
+                    comparison["metric"],
+                    "%.2f" % comparison["baseline"],
+                    "%.2f" % comparison["run"],
+                    "%+.1f%%" % (comparison["change"] * 100),
+                    "REGRESSION" if comparison["regression"] else "",
+                )
+            )
+        msg.table(rows, header=["Metric", "Baseline", "Run", "Change", ""], divider=True)
+    if regressions:
+        msg.fail(f"Found {regressions} regression(s) above {threshold:.0%}", exits=1)
+    msg.good("No regressions found")
+
+
+def _warn_differences(run, baseline):
+    """Point out what changed between the runs besides the measurements."""
+    for key in ("versions", "config"):
+        for field in sorted(set(run[key]) | set(baseline[key])):
+            if run[key].get(field) != baseline[key].get(field):
+                msg.warn(f"{field}: {baseline[key].get(field)} -> {run[key].get(field)}")
+    if run["model_hash"] != baseline["model_hash"]:
+        msg.warn("The model files differ")
+    if run["host"].get("hostname") != baseline["host"].get("hostname"):
+        msg.warn(f"Host: {baseline['host'].get('hostname')} -> {run['host'].get('hostname')}")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,87 @@
+from typing import Any, Dict, Iterable, Iterator
+from collections import defaultdict
+import timeit
+
+
+class ComponentStats:
+    """Accumulated wall time and number of documents per pipeline component."""
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = defaultdict(float)
+        self.docs: Dict[str, int] = defaultdict(int)
+
+    def reset(self) -> None:
+        self.seconds.clear()
+        self.docs.clear()
+
+    def add(self, name: str, seconds: float, docs: int) -> None:
+        self.seconds[name] += seconds
+        self.docs[name] += docs
+
+
+class _TimedIterator:
+    """Wrap the stream of docs fed into a component, measuring the time spent
+    producing them upstream so it can be subtracted from the component's time."""
+
+    def __init__(self, docs: Iterable):
+        self.docs = iter(docs)
+        self.seconds = 0.0
+
+    def __iter__(self) -> "_TimedIterator":
+        return self
+
+    def __next__(self):
+        start = timeit.default_timer()
+        try:
+            return next(self.docs)
+        finally:
+            self.seconds += timeit.default_timer() - start
+
+
+class TimedComponent:
+    """Proxy for a pipeline component that records the time spent in its
+    __call__ and pipe methods. All other attributes are delegated to the
+    wrapped component."""
+
+    def __init__(self, name: str, component: Any, stats: ComponentStats):
+        self.name = name
+        self.component = component
+        self.stats = stats
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self.component, attr)
+
+    def __call__(self, doc, **kwargs):
+        start = timeit.default_timer()
+        doc = self.component(doc, **kwargs)
+        self.stats.add(self.name, timeit.default_timer() - start, 1)
+        return doc
+
+    def pipe(self, docs: Iterable, **kwargs) -> Iterator:
+        upstream = _TimedIterator(docs)
+        if hasattr(self.component, "pipe"):
+            stream = self.component.pipe(upstream, **kwargs)
+        else:
+            # Mirror Language.pipe for components that only implement __call__
+            kwargs.pop("batch_size", None)
+            stream = (self.component(doc, **kwargs) for doc in upstream)
+        while True:
+            start = timeit.default_timer()
+            upstream_before = upstream.seconds
+            try:
+                doc = next(stream)
+            except StopIteration:
+                return
+            # Components pull docs from upstream lazily, so exclude the time
+            # spent in earlier components while waiting for the next doc
+            seconds = timeit.default_timer() - start - (upstream.seconds - upstream_before)
+            self.stats.add(self.name, seconds, 1)
+            yield doc
+
+
+def instrument_pipeline(nlp, stats: ComponentStats) -> None:
+    """Replace every component in the pipeline by a TimedComponent proxy."""
+    # There's no public API to swap a component instance in place, and
+    # nlp.replace_pipe would create a new (untrained) component from its factory
+    for i, (name, component) in enumerate(nlp._components):
+        nlp._components[i] = (name, TimedComponent(name, component, stats))
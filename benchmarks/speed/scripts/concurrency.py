@@ -0,0 +1,94 @@
+from typing import Callable, Iterator, List
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import threading
+import timeit
+
+from latency import LatencyHistogram
+
+
+class ConcurrencyResult:
+    """Latencies, request and error counts of one concurrency level. Only the
+    requests that succeeded count towards the latency and the words processed."""
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.requests = 0
+        self.errors = 0
+        self.words = 0
+        self.seconds = 0.0
+
+    def add(self, seconds: float, error: bool, words: int) -> None:
+        self.requests += 1
+        if error:
+            self.errors += 1
+        else:
+            self.words += words
+            self.latency.add(seconds)
+
+
+def _count_words(request: List[str]) -> int:
+    # Counted the same way as by the Corpus
+    return sum(len(text.split()) for text in request)
+
+
+def hammer_threads(
+    process: Callable[[List[str]], None], requests: Iterator[List[str]], concurrency: int
+) -> ConcurrencyResult:
+    """Send the requests to `process` from `concurrency` threads, each of which
+    sends its next request as soon as its previous one has returned."""
+    result = ConcurrencyResult()
+    lock = threading.Lock()
+
+    def caller():
+        while True:
+            with lock:
+                request = next(requests, None)
+            if request is None:
+                return
+            error = False
+            start = timeit.default_timer()
+            try:
+                process(request)
+            except Exception:
+                error = True
+            seconds = timeit.default_timer() - start
+            with lock:
+                result.add(seconds, error, _count_words(request))
+
+    start = timeit.default_timer()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(caller)
+    result.seconds = timeit.default_timer() - start
+    return result
+
+
+def hammer_asyncio(
+    process: Callable[[List[str]], None], requests: Iterator[List[str]], concurrency: int, n_threads: int
+) -> ConcurrencyResult:
+    """Send the requests from `concurrency` asyncio tasks that hand the blocking
+    call off to a fixed pool of n_threads threads, as an async web service
+    would. With more tasks than threads, requests wait for a free thread, and
+    the latency includes that wait."""
+    result = ConcurrencyResult()
+
+    async def caller(loop, executor):
+        for request in requests:
+            error = False
+            start = timeit.default_timer()
+            try:
+                await loop.run_in_executor(executor, process, request)
+            except Exception:
+                error = True
+            result.add(timeit.default_timer() - start, error, _count_words(request))
+
+    async def run():
+        loop = asyncio.get_event_loop()
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            await asyncio.gather(*(caller(loop, executor) for _ in range(concurrency)))
+
+    start = timeit.default_timer()
+    asyncio.run(run())
+    result.seconds = timeit.default_timer() - start
+    return result
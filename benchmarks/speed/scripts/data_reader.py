@@ -1,21 +1,74 @@
-from typing import List
+from typing import Callable, Iterable, Iterator, List, TypeVar
+from collections import deque
+from itertools import islice
 import re
 from pathlib import Path
 import srsly
 from spacy.util import minibatch
 
+MIN_WORDS = 5
+T = TypeVar("T")
+
+
+class Corpus:
+    """Stream the texts from a directory of .jsonl and .txt files without
+    loading them into memory. Texts with fewer than MIN_WORDS words are
+    skipped, and at most `limit` texts are yielded. The number of articles,
+    characters and words is counted while iterating, so the statistics are
+    available after each full pass over the corpus.
+
+    min_words and max_words restrict the corpus to a range of text lengths
+    (max_words is exclusive, 0 means no maximum). The limit applies to the
+    texts within that range."""
+
+    def __init__(self, txt_dir: Path, limit: int = 0, min_words: int = MIN_WORDS, max_words: int = 0):
+        self.txt_dir = txt_dir
+        self.limit = limit
+        self.min_words = max(min_words, MIN_WORDS)
+        self.max_words = max_words
+        self.articles = 0
+        self.characters = 0
+        self.words = 0
+
+    def __iter__(self) -> Iterator[str]:
+        self.articles = 0
+        self.characters = 0
+        self.words = 0
+        for text in self._read_texts():
+            # The word count is needed for filtering anyway, so keeping track of
+            # the statistics here doesn't add another pass over the data
+            n_words = len(text.split())
+            if n_words < self.min_words or (self.max_words and n_words >= self.max_words):
+                continue
+            text = text.strip()
+            self.articles += 1
+            self.characters += len(text)
+            self.words += n_words
+            yield text
+            if self.limit and self.articles >= self.limit:
+                return
+
+    def is_empty(self) -> bool:
+        return next(iter(self), None) is None
+
+    def _read_texts(self) -> Iterator[str]:
+        # Sorted, so that sharded corpora are read in a deterministic order
+        for file in sorted(self.txt_dir.iterdir()):
+            if not file.is_file():
+                continue
+            if file.parts[-1].endswith("jsonl"):
+                yield from (record["text"] for record in srsly.read_jsonl(file))
+            else:
+                yield file.read_text()
+
 
 def read_data(txt_dir: Path, limit: int = 0) -> List[str]:
-    texts = []
-    for file in txt_dir.iterdir():
-        if file.parts[-1].endswith("jsonl"):
-            texts.extend(record["text"] for record in srsly.read_jsonl(file))
-        else:
-            texts.append(file.read_text())
-    texts = [text.strip() for text in texts if len(text.split()) >= 5]
-    if limit:
-        texts = texts[:limit]
-    return texts
+    return list(Corpus(txt_dir, limit=limit))
+
+
+def write_jsonl_shard(path: Path, texts: Iterable[str]) -> None:
+    """Stream texts to a .jsonl file in the format read by Corpus."""
+    srsly.write_jsonl(path, ({"text": text} for text in texts))
 
 
 def rebatch_texts(texts, batch_size):
@@ -24,3 +77,30 @@ def rebatch_texts(texts, batch_size):
         batch = [newline_re.sub("\n", text) for text in batch]
         batch = "\n\n".join(batch)
         yield batch
+
+
+def process_sorted_by_length(
+    process: Callable[[Iterable[str]], Iterable[T]], texts: Iterable[str], window: int
+) -> Iterator[T]:
+    """Sort the texts by length within windows of `window` texts, so that texts
+    of similar length end up in the same batch, and pass them through `process`
+    as a single stream. `process` must return one output per text, in order.
+    The outputs are yielded in the original order of the texts."""
+    orders = deque()
+
+    def sorted_texts():
+        for window_texts in minibatch(texts, size=window):
+            order = sorted(range(len(window_texts)), key=lambda i: len(window_texts[i]))
+            orders.append(order)
+            yield from (window_texts[i] for i in order)
+
+    outputs = iter(process(sorted_texts()))
+    for first in outputs:
+        # The process has consumed the window's texts by the time it produces
+        # their first output, so its order is in the queue
+        order = orders.popleft()
+        window_outputs = [first, *islice(outputs, len(order) - 1)]
+        restored = [None] * len(order)
+        for i, output in zip(order, window_outputs):
+            restored[i] = output
+        yield from restored
@@ -0,0 +1,133 @@
+from typing import Iterator, List
+from pathlib import Path
+from multiprocessing import Pool
+import functools
+import math
+import random
+import typer
+from wasabi import msg
+
+from data_reader import MIN_WORDS, write_jsonl_shard
+
+CONSONANTS = "bcdfghjklmnprstvwz"
+VOWELS = "aeiou"
+
+
+def main(
+    output_dir: Path,
+    n_texts: int,
+    shard_size: int = 100000,
+    seed: int = 0,
+    vocab_size: int = 50000,
+    zipf_exponent: float = 1.1,
+    median_words: int = 60,
+    length_sigma: float = 1.0,
+    max_words: int = 2000,
+    sentence_words: int = 15,
+    paragraph_sentences: int = 5,
+    n_process: int = 1,
+):
+    """Generate a synthetic corpus of n_texts texts as sharded .jsonl files that
+    can be used as the txt_dir of run_nlp.py. Text lengths (in words) follow a
+    log-normal distribution around median_words, and words are drawn from a
+    vocabulary of made-up words with Zipfian frequencies. Sentences average
+    sentence_words words, and paragraphs paragraph_sentences sentences.
+
+    Every shard is generated from its own random seed derived from `seed`, so
+    the output is deterministic however many processes generate the shards,
+    and any shard can be regenerated on its own."""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    vocab = _make_vocab(random.Random(seed), vocab_size)
+    # Cumulative weights let random.choices sample the Zipfian distribution fast
+    cum_weights = []
+    total = 0.0
+    for rank in range(1, vocab_size + 1):
+        total += 1 / rank ** zipf_exponent
+        cum_weights.append(total)
+    n_shards = math.ceil(n_texts / shard_size)
+    shards = [(shard, min(shard_size, n_texts - shard * shard_size)) for shard in range(n_shards)]
+    write_shard = functools.partial(
+        _write_shard,
+        output_dir=output_dir,
+        seed=seed,
+        vocab=vocab,
+        cum_weights=cum_weights,
+        median_words=median_words,
+        length_sigma=length_sigma,
+        max_words=max_words,
+        sentence_words=sentence_words,
+        paragraph_sentences=paragraph_sentences,
+    )
+    with Pool(n_process) as pool:
+        for path, count in pool.imap(write_shard, shards):
+            msg.text(f"Wrote {count} texts to {path}")
+    msg.good(f"Generated {n_texts} texts in {n_shards} shard(s) in {output_dir}")
+
+
+def _write_shard(shard_count, output_dir: Path, seed: int, **settings):
+    shard, count = shard_count
+    rng = random.Random(f"{seed}-{shard}")
+    texts = (_make_text(rng, **settings) for _ in range(count))
+    path = output_dir / f"synthetic-{shard:05d}.jsonl"
+    write_jsonl_shard(path, texts)
+    return path, count
+
+
+def _make_vocab(rng: random.Random, vocab_size: int) -> List[str]:
+    """Make up vocab_size unique pronounceable words. Shorter words come first,
+    so the most frequent words are also the shortest, like in natural text."""
+    vocab = set()
+    n_syllables = 1
+    while len(vocab) < vocab_size:
+        # Add words of increasing length once the short ones are used up
+        before = len(vocab)
+        for _ in range(vocab_size * 2):
+            vocab.add("".join(rng.choice(CONSONANTS) + rng.choice(VOWELS) for _ in range(n_syllables)))
+            if len(vocab) >= vocab_size:
+                break
+        if len(vocab) - before < vocab_size // 100:
+            n_syllables += 1
+    return sorted(vocab, key=lambda word: (len(word), word))
+
+
+def _make_text(
+    rng: random.Random,
+    vocab: List[str],
+    cum_weights: List[float],
+    median_words: int,
+    length_sigma: float,
+    max_words: int,
+    sentence_words: int,
+    paragraph_sentences: int,
+) -> str:
+    n_words = int(rng.lognormvariate(math.log(median_words), length_sigma))
+    n_words = min(max(n_words, MIN_WORDS), max_words)
+    words = rng.choices(vocab, cum_weights=cum_weights, k=n_words)
+    paragraphs = []
+    sentences = []
+    for sentence in _split_sentences(rng, words, sentence_words):
+        sentences.append(sentence)
+        if rng.random() < 1 / paragraph_sentences:
+            paragraphs.append(" ".join(sentences))
+            sentences = []
+    if sentences:
+        paragraphs.append(" ".join(sentences))
+    return "\n\n".join(paragraphs)
+
+
+def _split_sentences(rng: random.Random, words: List[str], sentence_words: int) -> Iterator[str]:
+    i = 0
+    while i < len(words):
+        length = max(1, int(rng.expovariate(1 / sentence_words)))
+        sentence = words[i : i + length]
+        i += length
+        # Sprinkle some commas in longer sentences
+        for j in range(2, len(sentence) - 1):
+            if rng.random() < 0.05:
+                sentence[j] += ","
+        sentence[0] = sentence[0].capitalize()
+        yield " ".join(sentence) + rng.choice(".......?!")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,38 @@
+from typing import Dict
+from collections import defaultdict
+import math
+
+
+class LatencyHistogram:
+    """Streaming latency histogram with logarithmically spaced buckets, so that
+    percentiles can be estimated in constant memory however many documents are
+    processed. Each bucket is `growth` times wider than the previous one, which
+    bounds the relative error of the reported percentiles (1% by default)."""
+
+    def __init__(self, min_seconds: float = 1e-6, growth: float = 1.01):
+        self.min_seconds = min_seconds
+        self.log_growth = math.log(growth)
+        self.counts: Dict[int, int] = defaultdict(int)
+        self.n = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        bucket = int(math.log(max(seconds, self.min_seconds) / self.min_seconds) / self.log_growth)
+        self.counts[bucket] += 1
+        self.n += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q: float) -> float:
+        """Return an upper bound on the q-th percentile (0-100) in seconds."""
+        if not self.n:
+            return 0.0
+        rank = math.ceil(q / 100 * self.n)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                upper = self.min_seconds * math.exp((bucket + 1) * self.log_growth)
+                return min(upper, self.max)
+        return self.max
@@ -1,20 +1,63 @@
-from typing import Callable
+from typing import Any, Callable, Dict, List, Optional
 from pathlib import Path
 from datetime import datetime
 from wasabi import msg
+import srsly
+
+from latency import LatencyHistogram
+from components import ComponentStats
+from stats import summarize
+from concurrency import ConcurrencyResult
+
+
+def _init_results_file(results_file: Path, columns: str) -> None:
+    """Write the header of a new results file. A file that was written with
+    different columns by an earlier version of the benchmark is moved aside, so
+    that every line in the file matches its header."""
+    if results_file.exists():
+        with results_file.open("r", encoding="utf8") as f:
+            existing = f.readline().rstrip("\n")
+        if existing == columns:
+            return
+        stamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        moved = results_file.with_name(f"{results_file.stem}.{stamp}{results_file.suffix}")
+        results_file.rename(moved)
+        msg.info(f"Columns of {results_file} changed: moved previous results to {moved}")
+    with results_file.open("w", encoding="utf8") as f:
+        f.write(columns)
+        f.write("\n")
+
+
+def _ms(seconds: Optional[float]) -> str:
+    return "-" if seconds is None else "%.1f" % (seconds * 1000)
+
+
+def _tps(tps: Optional[float]) -> str:
+    return "-" if tps is None else "%.1fk" % tps
+
+
+def _percent(fraction: Optional[float]) -> str:
+    return "-" if fraction is None else "%.0f%%" % (fraction * 100)
+
+
+def _token_throughput(token_counts: Optional[Dict[str, int]], seconds: float):
+    """Return the thousands of (non-padding) tokens per second, and the share of
+    padding in the batches, for runners that count the tokens they process."""
+    if not token_counts or not token_counts["padded_tokens"]:
+        return None, None
+    tps = token_counts["tokens"] / seconds / 1000
+    padding = 1 - token_counts["tokens"] / token_counts["padded_tokens"]
+    return tps, padding
 
 
 def create_logger(results_dir: Path) -> Callable:
     results_file = results_dir / "results.csv"
-    write_header = not results_file.exists()
-    with results_file.open("a", encoding="utf8") as f:
-        if write_header:
-            f.write(
-                "library;name;gpu;articles;characters;words;seconds;k wps;time stamp"
-            )
-            f.write("\n")
+    _init_results_file(
+        results_file,
+        "library;name;gpu;articles;characters;words;repeats;seconds;k wps;k wps std;k wps ci95;k tps;padding %;load s;first doc ms;p50 ms;p90 ms;p99 ms;max ms;load mb;peak mb;time stamp",
+    )
 
-    header = ["Library", "Model", "GPU?", "# Texts", "# Chars", "# Words", "# Seconds", "W/S", "Timestamp"]
+    header = ["Library", "Model", "GPU?", "# Texts", "# Chars", "# Words", "# Seconds", "W/S", "T/S", "Padding", "Load s", "First ms", "P50 ms", "P90 ms", "P99 ms", "Max ms", "Load MB", "Peak MB", "Timestamp"]
     widths = [max(15, len(head)) for head in header]
     widths[-1] = len(str(datetime.now().isoformat(timespec="seconds")))
     msg.row(header, widths=widths)
@@ -25,17 +68,292 @@ def create_logger(results_dir: Path) -> Callable:
         articles: int,
         characters: int,
         words: int,
-        seconds: int,
+        seconds: List[float],
+        load_seconds: float,
+        first_doc_seconds: float,
+        load_mb: float,
+        peak_mb: float,
+        latency: Optional[LatencyHistogram] = None,
+        token_counts: Optional[Dict[str, int]] = None,
+    ):
+        # Throughput is summarised over the timed repetitions, excluding warm-up
+        repeats = len(seconds)
+        mean_seconds = sum(seconds) / repeats
+        wps, wps_std, wps_ci = summarize([words / s / 1000 for s in seconds])
+        wps_range = "%.1fk" % wps if wps_ci is None else "%.1fk ±%.1fk" % (wps, wps_ci)
+        tps, padding = _token_throughput(token_counts, mean_seconds)
+        # Per-document latencies are only available when timing each document
+        if latency is not None:
+            p50, p90, p99 = (latency.percentile(q) for q in (50, 90, 99))
+            max_latency = latency.max
+        else:
+            p50 = p90 = p99 = max_latency = None
+
+        timestamp = datetime.now().isoformat(timespec="seconds")
+        row = [library, name, gpu, articles, characters, words, "%.1f" % mean_seconds, wps_range, _tps(tps), _percent(padding), "%.1f" % load_seconds, _ms(first_doc_seconds), _ms(p50), _ms(p90), _ms(p99), _ms(max_latency), "%.0f" % load_mb, "%.0f" % peak_mb, timestamp]
+        msg.row(data=row, widths=widths)
+
+        latencies = ";".join("" if value is None else str(value * 1000) for value in (p50, p90, p99, max_latency))
+        spread = ";".join("" if value is None else str(value) for value in (wps_std, wps_ci, tps, padding))
+        result = f"{library};{name};{gpu};{articles};{characters};{words};{repeats};{mean_seconds};{wps};{spread};{load_seconds};{first_doc_seconds * 1000};{latencies};{load_mb};{peak_mb};{timestamp}"
+        with results_file.open("a", encoding="utf8") as f:
+            f.write(result + "\n")
+
+        return {
+            "timestamp": timestamp,
+            "library": library,
+            "name": name,
+            "gpu": gpu,
+            "articles": articles,
+            "characters": characters,
+            "words": words,
+            "repeats": repeats,
+            "seconds": mean_seconds,
+            "k_wps": wps,
+            "k_wps_std": wps_std,
+            "k_wps_ci95": wps_ci,
+            "k_tps": tps,
+            "padding": padding,
+            "load_seconds": load_seconds,
+            "first_doc_ms": first_doc_seconds * 1000,
+            "p50_ms": None if p50 is None else p50 * 1000,
+            "p90_ms": None if p90 is None else p90 * 1000,
+            "p99_ms": None if p99 is None else p99 * 1000,
+            "max_ms": None if max_latency is None else max_latency * 1000,
+            "load_mb": load_mb,
+            "peak_mb": peak_mb,
+        }
+
+    return log_result
+
+
+def write_run_details(results_dir: Path, library: str, name: str, details: Dict[str, Any]) -> Path:
+    """Write the full measurements of a single run to a JSON file in the runs/
+    subdirectory of the results directory."""
+    runs_dir = results_dir / "runs"
+    runs_dir.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    details_file = runs_dir / f"{timestamp}_{library}_{Path(name).name}.json"
+    srsly.write_json(details_file, details)
+    return details_file
+
+
+def create_scaling_logger(results_dir: Path) -> Callable:
+    results_file = results_dir / "scaling.csv"
+    _init_results_file(
+        results_file,
+        "library;name;gpu;n_process;articles;words;seconds;k wps;speedup;efficiency;main mb;worker mb;total mb;time stamp",
+    )
+
+    header = ["Model", "# Procs", "# Seconds", "W/S", "Speedup", "Efficiency", "Main MB", "Worker MB", "Total MB"]
+    widths = [max(15, len(head)) for head in header]
+    msg.row(header, widths=widths)
+    def log_scaling(
+        library: str,
+        name: str,
+        gpu: bool,
+        n_process: int,
+        articles: int,
+        words: int,
+        seconds: float,
+        baseline_wps: float,
+        main_mb: float,
+        worker_mb: float,
+        total_mb: float,
     ):
         wps = words / seconds
+        # Speedup and parallel efficiency are relative to the single-process run
+        speedup = wps / baseline_wps
+        efficiency = speedup / n_process
         wps = wps / 1000
 
         timestamp = datetime.now().isoformat(timespec="seconds")
-        row = [library, name, gpu, articles, characters, words, int(seconds), "%.1fk" % wps, timestamp]
+        row = [name, n_process, "%.1f" % seconds, "%.1fk" % wps, "%.2fx" % speedup, "%.0f%%" % (efficiency * 100), "%.0f" % main_mb, "%.0f" % worker_mb, "%.0f" % total_mb]
         msg.row(data=row, widths=widths)
 
-        result = f"{library};{name};{gpu};{articles};{characters};{words};{seconds};{wps};{timestamp}"
+        result = f"{library};{name};{gpu};{n_process};{articles};{words};{seconds};{wps};{speedup};{efficiency};{main_mb};{worker_mb};{total_mb};{timestamp}"
         with results_file.open("a", encoding="utf8") as f:
             f.write(result + "\n")
 
-    return log_result
+    return log_scaling
+
+
+def log_component_breakdown(
+    results_dir: Path,
+    library: str,
+    name: str,
+    gpu: bool,
+    seconds: float,
+    stats: ComponentStats,
+) -> None:
+    """Print and store the share of the total processing time spent in each
+    pipeline component. Whatever isn't spent in a component (tokenization,
+    batching, iterating over the results) is reported as 'other'."""
+    results_file = results_dir / "components.csv"
+    _init_results_file(results_file, "library;name;gpu;component;docs;seconds;share;time stamp")
+
+    timestamp = datetime.now().isoformat(timespec="seconds")
+    rows = [(component, stats.docs[component], stats.seconds[component]) for component in stats.seconds]
+    rows.append(("other", None, max(0.0, seconds - sum(stats.seconds.values()))))
+    table = []
+    with results_file.open("a", encoding="utf8") as f:
+        for component, docs, component_seconds in rows:
+            share = component_seconds / seconds
+            table.append((component, "-" if docs is None else docs, "%.2f" % component_seconds, "%.1f%%" % (share * 100)))
+            docs = "" if docs is None else docs
+            f.write(f"{library};{name};{gpu};{component};{docs};{component_seconds};{share};{timestamp}\n")
+    msg.table(table, header=["Component", "# Docs", "# Seconds", "Share"], divider=True)
+
+
+def create_batch_size_logger(results_dir: Path) -> Callable:
+    results_file = results_dir / "batch_sizes.csv"
+    _init_results_file(
+        results_file,
+        "library;name;gpu;batch by;batch size;effective size;articles;words;seconds;k wps;k tps;padding %;time stamp",
+    )
+
+    header = ["Model", "Batch by", "Batch size", "Effective size", "# Seconds", "W/S", "T/S", "Padding"]
+    widths = [max(15, len(head)) for head in header]
+    msg.row(header, widths=widths)
+    def log_batch_size(
+        library: str,
+        name: str,
+        gpu: bool,
+        batch_by: str,
+        batch_size: int,
+        effective_size: int,
+        articles: int,
+        words: int,
+        seconds: float,
+        token_counts: Optional[Dict[str, int]] = None,
+    ):
+        wps = words / seconds
+        wps = wps / 1000
+        tps, padding = _token_throughput(token_counts, seconds)
+
+        timestamp = datetime.now().isoformat(timespec="seconds")
+        row = [name, batch_by, batch_size, effective_size, "%.1f" % seconds, "%.1fk" % wps, _tps(tps), _percent(padding)]
+        msg.row(data=row, widths=widths)
+
+        tokens = ";".join("" if value is None else str(value) for value in (tps, padding))
+        result = f"{library};{name};{gpu};{batch_by};{batch_size};{effective_size};{articles};{words};{seconds};{wps};{tokens};{timestamp}"
+        with results_file.open("a", encoding="utf8") as f:
+            f.write(result + "\n")
+
+    return log_batch_size
+
+
+def update_best_batch_sizes(
+    results_dir: Path,
+    library: str,
+    name: str,
+    gpu: bool,
+    best: Dict[str, Any],
+    curve: List[Dict[str, Any]],
+) -> Path:
+    """Store the best batch size setting found for a model, together with the
+    full throughput curve, in best_batch_sizes.json keyed by library/model/gpu."""
+    best_file = results_dir / "best_batch_sizes.json"
+    settings = srsly.read_json(best_file) if best_file.exists() else {}
+    settings[f"{library}/{name}/{'gpu' if gpu else 'cpu'}"] = {
+        **best,
+        "curve": curve,
+        "time stamp": datetime.now().isoformat(timespec="seconds"),
+    }
+    srsly.write_json(best_file, settings)
+    return best_file
+
+
+def create_length_bucket_logger(results_dir: Path) -> Callable:
+    results_file = results_dir / "length_buckets.csv"
+    _init_results_file(
+        results_file,
+        "library;name;gpu;sort window;bucket;articles;words;seconds;k wps;time stamp",
+    )
+
+    header = ["Model", "Sort window", "# Words/text", "# Texts", "# Words", "# Seconds", "W/S"]
+    widths = [max(15, len(head)) for head in header]
+    msg.row(header, widths=widths)
+    def log_bucket(
+        library: str,
+        name: str,
+        gpu: bool,
+        sort_window: int,
+        bucket: str,
+        articles: int,
+        words: int,
+        seconds: float,
+    ):
+        wps = words / seconds
+        wps = wps / 1000
+
+        timestamp = datetime.now().isoformat(timespec="seconds")
+        row = [name, sort_window or "-", bucket, articles, words, "%.1f" % seconds, "%.1fk" % wps]
+        msg.row(data=row, widths=widths)
+
+        result = f"{library};{name};{gpu};{sort_window};{bucket};{articles};{words};{seconds};{wps};{timestamp}"
+        with results_file.open("a", encoding="utf8") as f:
+            f.write(result + "\n")
+
+    return log_bucket
+
+
+def create_concurrency_logger(results_dir: Path) -> Callable:
+    results_file = results_dir / "concurrency.csv"
+    _init_results_file(
+        results_file,
+        "library;name;gpu;mode;concurrency;request size;requests;errors;articles;words;seconds;k wps;requests/s;p50 ms;p90 ms;p99 ms;max ms;time stamp",
+    )
+
+    header = ["Model", "Mode", "Concurrency", "# Requests", "# Errors", "W/S", "Requests/s", "P50 ms", "P90 ms", "P99 ms", "Max ms"]
+    widths = [max(15, len(head)) for head in header]
+    msg.row(header, widths=widths)
+    def log_concurrency(
+        library: str,
+        name: str,
+        gpu: bool,
+        mode: str,
+        concurrency: int,
+        request_size: int,
+        articles: int,
+        stats: ConcurrencyResult,
+    ):
+        # Failed requests don't count towards the throughput
+        seconds = stats.seconds
+        words = stats.words
+        wps = words / seconds
+        wps = wps / 1000
+        requests_per_second = (stats.requests - stats.errors) / seconds
+        p50, p90, p99 = (stats.latency.percentile(q) for q in (50, 90, 99))
+
+        timestamp = datetime.now().isoformat(timespec="seconds")
+        row = [name, mode, concurrency, stats.requests, stats.errors, "%.1fk" % wps, "%.1f" % requests_per_second, _ms(p50), _ms(p90), _ms(p99), _ms(stats.latency.max)]
+        msg.row(data=row, widths=widths)
+
+        latencies = ";".join(str(value * 1000) for value in (p50, p90, p99, stats.latency.max))
+        result = f"{library};{name};{gpu};{mode};{concurrency};{request_size};{stats.requests};{stats.errors};{articles};{words};{seconds};{wps};{requests_per_second};{latencies};{timestamp}"
+        with results_file.open("a", encoding="utf8") as f:
+            f.write(result + "\n")
+
+    return log_concurrency
+
+
+def log_startup_profile(results_dir: Path, name: str, runs: List[Dict[str, float]]) -> None:
+    """Print and store the mean time of each phase of loading a pipeline over
+    repeated cold starts. 'process' is the wall time of the whole subprocess,
+    including the interpreter start-up."""
+    results_file = results_dir / "startup.csv"
+    _init_results_file(results_file, "name;phase;repeats;mean seconds;std seconds;share;time stamp")
+
+    timestamp = datetime.now().isoformat(timespec="seconds")
+    total = sum(run["process"] for run in runs) / len(runs)
+    table = []
+    with results_file.open("a", encoding="utf8") as f:
+        for phase in runs[0]:
+            mean, std, _ = summarize([run[phase] for run in runs])
+            share = mean / total
+            table.append((phase, "%.3f" % mean, "-" if std is None else "%.3f" % std, "%.1f%%" % (share * 100)))
+            std = "" if std is None else std
+            f.write(f"{name};{phase};{len(runs)};{mean};{std};{share};{timestamp}\n")
+    msg.divider(name)
+    msg.table(table, header=["Phase", "Mean s", "Std s", "Share"], divider=True)
@@ -0,0 +1,70 @@
+import threading
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+import psutil
+
+
+MB = 1024 * 1024
+
+
+class MemoryMonitor:
+    """Sample the resident set size (RSS) of the current process and all of its
+    child processes in a background thread, keeping track of the peaks. Use it
+    as a context manager around the code that should be measured."""
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak_main = 0
+        self.peak_child = 0
+        self.peak_total = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "MemoryMonitor":
+        self._stop.clear()
+        self.sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.sample()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self) -> None:
+        main = self.process.memory_info().rss
+        children = []
+        for child in self.process.children(recursive=True):
+            # Worker processes can exit between listing and sampling them
+            try:
+                children.append(child.memory_info().rss)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        self.peak_main = max(self.peak_main, main)
+        self.peak_child = max([self.peak_child, *children])
+        self.peak_total = max(self.peak_total, main + sum(children))
+
+
+def current_rss() -> int:
+    """Return the resident set size of the current process in bytes."""
+    return psutil.Process().memory_info().rss
+
+
+def top_allocations(snapshot: tracemalloc.Snapshot, limit: int) -> List[Dict[str, Any]]:
+    """Summarise the allocation sites of a tracemalloc snapshot that hold the
+    most memory."""
+    allocations = []
+    for stat in snapshot.statistics("lineno")[:limit]:
+        frame = stat.traceback[0]
+        allocations.append(
+            {"file": frame.filename, "line": frame.lineno, "mb": stat.size / MB, "count": stat.count}
+        )
+    return allocations
@@ -0,0 +1,91 @@
+from typing import Dict
+from pathlib import Path
+import subprocess
+import sys
+import timeit
+import typer
+import srsly
+
+
+def main(
+    result_dir: Path,
+    names: str,
+    repeats: int = 5,
+    child: bool = typer.Option(False, hidden=True),
+):
+    """Break down the time it takes to load spaCy pipelines into phases: importing
+    spaCy, locating the package and reading its config, resolving the config
+    into a pipeline with freshly created components, and loading the strings,
+    vectors, other vocab data, tokenizer and each component from disk. Every
+    load runs in a fresh subprocess, repeated `repeats` times per pipeline.
+    Note that the operating system's page cache stays warm between the runs."""
+    if child:
+        # Only the phases are written to stdout, so the parent can parse them
+        print(srsly.json_dumps(_profile_load(names)))
+        return
+    # Imported here, so the child processes don't pay for it
+    from logger import log_startup_profile
+
+    for name in names.split(","):
+        runs = []
+        for _ in range(repeats):
+            start = timeit.default_timer()
+            output = subprocess.run(
+                [sys.executable, __file__, str(result_dir), name, "--child"],
+                stdout=subprocess.PIPE,
+                check=True,
+            ).stdout
+            phases = srsly.json_loads(output.decode("utf8").strip().splitlines()[-1])
+            phases["process"] = timeit.default_timer() - start
+            runs.append(phases)
+        log_startup_profile(result_dir, name, runs)
+
+
+def _profile_load(name: str) -> Dict[str, float]:
+    """Load a pipeline the way spacy.load does, timing each phase."""
+    phases = {}
+    start = timeit.default_timer()
+
+    def phase(label: str) -> None:
+        nonlocal start
+        now = timeit.default_timer()
+        phases[label] = now - start
+        start = now
+
+    import spacy
+    import importlib
+
+    phase("import spacy")
+    if Path(name).exists():
+        model_path = Path(name)
+        meta = spacy.util.get_model_meta(model_path)
+    else:
+        package_path = Path(importlib.import_module(name).__file__).parent
+        meta = spacy.util.get_model_meta(package_path)
+        model_path = package_path / f"{meta['lang']}_{meta['name']}-{meta['version']}"
+    config = spacy.util.load_config(model_path / "config.cfg")
+    phase("read config")
+    nlp = spacy.util.load_model_from_config(config, meta=meta, vocab=True)
+    phase("resolve config")
+    # The following steps mirror Language.from_disk and Vocab.from_disk, split
+    # up so the individual parts can be timed
+    vocab_path = model_path / "vocab"
+    nlp.vocab.strings.from_disk(vocab_path / "strings.json")
+    phase("strings")
+    nlp.vocab.vectors.from_disk(vocab_path, exclude=["strings"])
+    phase("vectors")
+    nlp.vocab.from_disk(vocab_path, exclude=["strings", "vectors"])
+    phase("vocab data")
+    nlp.tokenizer.from_disk(model_path / "tokenizer", exclude=["vocab"])
+    phase("tokenizer")
+    for component_name, component in nlp.components:
+        if hasattr(component, "from_disk"):
+            component.from_disk(model_path / component_name, exclude=["vocab"])
+        phase(f"component: {component_name}")
+    nlp._link_components()
+    phase("link components")
+    return phases
+
+
+if __name__ == "__main__":
+    typer.run(main)
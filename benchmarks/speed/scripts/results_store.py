@@ -0,0 +1,200 @@
+from typing import Any, Dict, Iterable, List, Optional
+from pathlib import Path
+import hashlib
+import platform
+import sqlite3
+
+import psutil
+import srsly
+
+try:
+    from importlib.metadata import version, PackageNotFoundError
+except ImportError:  # Python < 3.8
+    from importlib_metadata import version, PackageNotFoundError
+
+
+# Packages whose versions are recorded with the runs of each library
+LIBRARY_PACKAGES = {
+    "spacy": ["spacy", "thinc", "spacy-transformers", "torch"],
+    "stanza": ["stanza", "torch"],
+    "hf_trf": ["transformers", "tokenizers", "torch"],
+    "flair": ["flair", "torch"],
+    "ud_pipe": ["ufal.udpipe"],
+}
+
+# Metrics stored for each run, and whether higher values are better
+METRICS = {
+    "k_wps": True,
+    "k_tps": True,
+    "load_seconds": False,
+    "first_doc_ms": False,
+    "p50_ms": False,
+    "p90_ms": False,
+    "p99_ms": False,
+    "max_ms": False,
+    "load_mb": False,
+    "peak_mb": False,
+}
+
+COLUMNS = [
+    ("timestamp", "TEXT"),
+    ("library", "TEXT"),
+    ("name", "TEXT"),
+    ("gpu", "INTEGER"),
+    ("host", "TEXT"),
+    ("versions", "TEXT"),
+    ("model_hash", "TEXT"),
+    ("config", "TEXT"),
+    ("articles", "INTEGER"),
+    ("characters", "INTEGER"),
+    ("words", "INTEGER"),
+    ("repeats", "INTEGER"),
+    ("seconds", "REAL"),
+    ("k_wps_std", "REAL"),
+    ("k_wps_ci95", "REAL"),
+    ("padding", "REAL"),
+    *((metric, "REAL") for metric in METRICS),
+]
+# Stored as JSON text, decoded again when reading runs
+JSON_COLUMNS = ("host", "versions", "config")
+
+
+class ResultsStore:
+    """SQLite database with one row per benchmark run, holding the measured
+    metrics together with the host, package versions, model hash and benchmark
+    configuration they were measured with."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.db = sqlite3.connect(str(path))
+        self.db.row_factory = sqlite3.Row
+        columns = ", ".join(f"{column} {kind}" for column, kind in COLUMNS)
+        self.db.execute(f"CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, {columns})")
+        # Databases created by earlier versions of the benchmark lack the
+        # columns added since, which are left empty for their runs
+        existing = {row["name"] for row in self.db.execute("PRAGMA table_info(runs)")}
+        for column, kind in COLUMNS:
+            if column not in existing:
+                self.db.execute(f"ALTER TABLE runs ADD COLUMN {column} {kind}")
+        self.db.execute("CREATE INDEX IF NOT EXISTS runs_model ON runs (library, name, gpu, timestamp)")
+        self.db.commit()
+
+    def add_run(self, record: Dict[str, Any]) -> int:
+        values = [
+            srsly.json_dumps(record[column]) if column in JSON_COLUMNS else record.get(column)
+            for column, _ in COLUMNS
+        ]
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        names = ", ".join(column for column, _ in COLUMNS)
+        cursor = self.db.execute(f"INSERT INTO runs ({names}) VALUES ({placeholders})", values)
+        self.db.commit()
+        return cursor.lastrowid
+
+    def get_run(self, run_id: int) -> Optional[Dict[str, Any]]:
+        row = self.db.execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+        return _decode(row) if row is not None else None
+
+    def latest_runs(self) -> List[Dict[str, Any]]:
+        """Return the most recent run of every library, model, device and
+        configuration."""
+        rows = self.db.execute(
+            "SELECT * FROM runs WHERE id IN (SELECT MAX(id) FROM runs GROUP BY library, name, gpu, config) ORDER BY id"
+        )
+        return [_decode(row) for row in rows]
+
+    def baseline(self, run: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Return the most recent earlier run of the same model on the same
+        device with the same benchmark configuration."""
+        row = self.db.execute(
+            "SELECT * FROM runs WHERE library = ? AND name = ? AND gpu = ? AND config = ? AND id < ? "
+            "ORDER BY id DESC LIMIT 1",
+            (run["library"], run["name"], run["gpu"], srsly.json_dumps(run["config"]), run["id"]),
+        ).fetchone()
+        return _decode(row) if row is not None else None
+
+
+def _decode(row: sqlite3.Row) -> Dict[str, Any]:
+    run = dict(row)
+    for column in JSON_COLUMNS:
+        run[column] = srsly.json_loads(run[column])
+    return run
+
+
+def compare_runs(run: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """Compare the metrics of a run against a baseline run. A metric regressed
+    if it changed for the worse by more than the relative threshold."""
+    comparisons = []
+    for metric, higher_is_better in METRICS.items():
+        new, old = run[metric], baseline[metric]
+        if new is None or old is None or old == 0:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        comparisons.append(
+            {"metric": metric, "baseline": old, "run": new, "change": change, "regression": worse > threshold}
+        )
+    return comparisons
+
+
+def host_info(gpu: bool) -> Dict[str, Any]:
+    info = {
+        "hostname": platform.node(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "python": platform.python_version(),
+        "physical_cores": psutil.cpu_count(logical=False),
+        "logical_cores": psutil.cpu_count(),
+        "memory_gb": round(psutil.virtual_memory().total / 1024 ** 3, 1),
+    }
+    if gpu:
+        import torch
+
+        info["gpu"] = torch.cuda.get_device_name(0)
+    return info
+
+
+def package_versions(packages: Iterable[str]) -> Dict[str, Optional[str]]:
+    versions = {}
+    for package in packages:
+        try:
+            versions[package] = version(package)
+        except PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+
+def model_hash(library: str, name: str) -> Optional[str]:
+    """Return a SHA-256 hash of the model's files, or None if the files of the
+    model can't be located."""
+    try:
+        path = _model_path(library, name)
+    except (ImportError, OSError, ValueError):
+        path = None
+    if path is None:
+        return None
+    files = sorted(p for p in path.rglob("*") if p.is_file()) if path.is_dir() else [path]
+    sha = hashlib.sha256()
+    for file in files:
+        sha.update(str(file.relative_to(path) if path.is_dir() else file.name).encode("utf8"))
+        with file.open("rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _model_path(library: str, name: str) -> Optional[Path]:
+    if Path(name).exists():
+        return Path(name)
+    if library == "spacy":
+        import spacy
+
+        return spacy.util.get_package_path(name)
+    if library == "hf_trf":
+        from huggingface_hub import snapshot_download
+
+        return Path(snapshot_download(name, local_files_only=True))
+    if library == "stanza":
+        from stanza.resources.common import DEFAULT_MODEL_DIR
+
+        return Path(DEFAULT_MODEL_DIR) / name.split("_")[0]
+    return None
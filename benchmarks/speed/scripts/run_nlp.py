@@ -1,18 +1,33 @@
-from typing import Callable, List
+from typing import Callable, Dict, Iterable, List, Optional
 
 import torch
 import typer
+import psutil
 import timeit
+import functools
+import tracemalloc
 import traceback
 from pathlib import Path
 import logging
 from wasabi import msg
 
-from data_reader import read_data, rebatch_texts
-from logger import create_logger
+from data_reader import Corpus, rebatch_texts, process_sorted_by_length
+from logger import create_logger, create_scaling_logger, create_batch_size_logger, create_length_bucket_logger
+from logger import create_concurrency_logger
+from logger import write_run_details, log_component_breakdown, update_best_batch_sizes
+from components import ComponentStats, instrument_pipeline
+from memory import MemoryMonitor, MB, current_rss, top_allocations
+from latency import LatencyHistogram
+from concurrency import hammer_threads, hammer_asyncio
+from results_store import ResultsStore, LIBRARY_PACKAGES, host_info, package_versions, model_hash
 from spacy.util import minibatch
 
 DEFAULT_BATCH_SIZE = 256
+# The raw transformer runner processes far fewer texts per forward pass than
+# the pipelines of the other libraries, so its batch size is scaled down
+HF_BATCH_DIVISOR = 20
+# Padded token budgets per forward pass tried when tuning the transformer runner
+TUNE_TOKEN_BUDGETS = [512, 1024, 2048, 4096, 8192, 16384]
 
 
 def main(
@@ -23,33 +38,176 @@ def main(
     gpu: bool,
     batch_size: int = DEFAULT_BATCH_SIZE,
     n_texts: int = 0,
+    sweep_cores: bool = False,
+    max_processes: int = 0,
+    per_doc: bool = False,
+    trace_allocations: int = 0,
+    time_components: bool = False,
+    max_tokens: int = 0,
+    tune_batch_size: bool = False,
+    min_batch_size: int = 16,
+    max_batch_size: int = 2048,
+    warmup: int = 0,
+    repeats: int = 1,
+    sort_window: int = 0,
+    length_buckets: str = "",
+    concurrency: str = "",
+    request_size: int = 1,
+    use_asyncio: bool = False,
+    asyncio_threads: int = 4,
 ):
+    if sweep_cores and (library != "spacy" or gpu):
+        msg.fail("Sweeping the number of processes is only supported for spaCy on CPU", exits=1)
+    if time_components and (library != "spacy" or sweep_cores):
+        msg.fail("Timing pipeline components is only supported for spaCy in a single process", exits=1)
+    if max_tokens and library != "hf_trf":
+        msg.fail("Batching by a token budget is only supported for the hf_trf runner", exits=1)
+    if sort_window and library not in ("spacy", "hf_trf"):
+        msg.fail("Sorting texts by length is only supported for the spacy and hf_trf runners", exits=1)
+    modes = {
+        "--sweep-cores": sweep_cores,
+        "--tune-batch-size": tune_batch_size,
+        "--length-buckets": length_buckets,
+        "--concurrency": concurrency,
+    }
+    modes = [flag for flag, enabled in modes.items() if enabled]
+    if len(modes) > 1:
+        msg.fail(f"Only one of {', '.join(modes)} can be used at a time", exits=1)
+    if modes:
+        # These only apply to the regular timed runs
+        options = {
+            "--repeats": repeats != 1,
+            "--per-doc": per_doc,
+            "--trace-allocations": trace_allocations,
+            "--time-components": time_components,
+        }
+        for option, enabled in options.items():
+            if enabled:
+                msg.fail(f"{option} can't be combined with {modes[0]}", exits=1)
     try:
-        data = read_data(txt_dir, limit=n_texts)
-        articles = len(data)
-        if articles == 0:
+        # The texts are streamed from disk during the timed runs, and the
+        # corpus statistics are collected on the way
+        corpus = Corpus(txt_dir, limit=n_texts)
+        if corpus.is_empty():
             msg.fail(
                 f"Could not read any data from {txt_dir}: make sure a corpus of .txt files is available."
             )
-        chars = sum([len(d) for d in data])
-        words = sum([len(d.split()) for d in data])
+            return
 
-        nlp_function = _get_run(library, name, gpu)
+        rss_before_load = current_rss()
+        component_stats = ComponentStats() if time_components else None
         start = timeit.default_timer()
-        nlp_function(data, batch_size)
-        end = timeit.default_timer()
+        nlp_function = _get_run(library, name, gpu, component_stats=component_stats)
+        load_seconds = timeit.default_timer() - start
+        rss_after_load = current_rss()
+        if max_tokens:
+            nlp_function = functools.partial(nlp_function, max_tokens=max_tokens)
+        if sort_window:
+            nlp_function = functools.partial(nlp_function, sort_window=sort_window)
+        # The first document pays for any lazy initialisation in the library,
+        # so its latency is reported separately from the steady-state numbers
+        start = timeit.default_timer()
+        nlp_function([next(iter(corpus))], batch_size)
+        first_doc_seconds = timeit.default_timer() - start
+        for _ in range(warmup):
+            nlp_function(iter(corpus), batch_size)
+        if component_stats is not None:
+            component_stats.reset()
+        if sweep_cores:
+            _sweep_cores(nlp_function, result_dir, name, corpus, batch_size, max_processes)
+            return
+        if tune_batch_size:
+            _tune_batch_size(nlp_function, result_dir, library, name, gpu, corpus, min_batch_size, max_batch_size)
+            return
+        if length_buckets:
+            boundaries = [int(boundary) for boundary in length_buckets.split(",")]
+            _run_length_buckets(nlp_function, result_dir, library, name, gpu, txt_dir, n_texts, batch_size, sort_window, boundaries)
+            return
+        if concurrency:
+            levels = [int(level) for level in concurrency.split(",")]
+            _run_concurrency(
+                nlp_function, result_dir, library, name, gpu, corpus, batch_size, levels, request_size, use_asyncio, asyncio_threads
+            )
+            return
+        latency = LatencyHistogram() if per_doc else None
+        seconds = []
+        if trace_allocations:
+            # Tracing slows down every allocation, so the timings of these runs
+            # shouldn't be compared against untraced ones
+            tracemalloc.start()
+        with MemoryMonitor() as monitor:
+            for _ in range(repeats):
+                start = timeit.default_timer()
+                if per_doc:
+                    token_counts = _run_per_doc(nlp_function, corpus, batch_size, latency)
+                else:
+                    token_counts = nlp_function(iter(corpus), batch_size)
+                end = timeit.default_timer()
+                seconds.append(end - start)
+        allocations = []
+        traced_peak = 0
+        if trace_allocations:
+            traced_peak = tracemalloc.get_traced_memory()[1]
+            allocations = top_allocations(tracemalloc.take_snapshot(), trace_allocations)
+            tracemalloc.stop()
 
         log_run = create_logger(result_dir)
-        s = end - start
-        log_run(
+        record = log_run(
             library=library,
             name=name,
             gpu=gpu,
-            articles=articles,
-            characters=chars,
-            words=words,
-            seconds=s,
+            articles=corpus.articles,
+            characters=corpus.characters,
+            words=corpus.words,
+            seconds=seconds,
+            load_seconds=load_seconds,
+            first_doc_seconds=first_doc_seconds,
+            load_mb=rss_after_load / MB,
+            peak_mb=monitor.peak_total / MB,
+            latency=latency,
+            token_counts=token_counts,
         )
+        details = {
+            "library": library,
+            "name": name,
+            "gpu": gpu,
+            "warmup": warmup,
+            "seconds": seconds,
+            "load_seconds": load_seconds,
+            "first_doc_seconds": first_doc_seconds,
+            "rss_before_load_mb": rss_before_load / MB,
+            "rss_after_load_mb": rss_after_load / MB,
+            "peak_rss_mb": monitor.peak_total / MB,
+            "peak_rss_main_mb": monitor.peak_main / MB,
+            "peak_rss_child_mb": monitor.peak_child / MB,
+            "allocations_traced": bool(trace_allocations),
+            "traced_peak_mb": traced_peak / MB,
+            "top_allocations": allocations,
+        }
+        packages = LIBRARY_PACKAGES[library] + ([name] if library == "spacy" else [])
+        record.update(
+            host=host_info(gpu),
+            versions=package_versions(packages),
+            model_hash=model_hash(library, name),
+            config={
+                "batch_size": batch_size,
+                "n_texts": n_texts,
+                "per_doc": per_doc,
+                "max_tokens": max_tokens,
+                "warmup": warmup,
+                "repeats": repeats,
+                "sort_window": sort_window,
+                "trace_allocations": trace_allocations,
+                "time_components": time_components,
+            },
+        )
+        store = ResultsStore(result_dir / "results.sqlite")
+        run_id = store.add_run(record)
+        msg.text(f"Stored run {run_id} in {store.path}")
+        if component_stats is not None:
+            log_component_breakdown(result_dir, library, name, gpu, sum(seconds), component_stats)
+        details_file = write_run_details(result_dir, library, name, details)
+        msg.text(f"Wrote run details to {details_file}")
     # Usually we avoid these kind of long try-except blocks, but here we just want to ensure
     # that the script can continue benchmarking the speed of other libraries if one fails
     except Exception as e:
@@ -57,9 +215,219 @@ def main(
         msg.info(traceback.format_exc())
 
 
-def _get_run(library: str, name: str, gpu: bool) -> Callable[[List[str]], None]:
+def _run_per_doc(
+    nlp_function: Callable, texts: Iterable[str], batch_size: int, latency: LatencyHistogram
+) -> Optional[Dict[str, int]]:
+    """Process the documents one at a time, recording the latency of each."""
+    total_counts = None
+    for text in texts:
+        start = timeit.default_timer()
+        token_counts = nlp_function([text], batch_size)
+        latency.add(timeit.default_timer() - start)
+        if token_counts is not None:
+            total_counts = total_counts or dict.fromkeys(token_counts, 0)
+            for key, count in token_counts.items():
+                total_counts[key] += count
+    return total_counts
+
+
+def _sweep_cores(
+    nlp_function: Callable,
+    result_dir: Path,
+    name: str,
+    corpus: Corpus,
+    batch_size: int,
+    max_processes: int,
+):
+    """Run the same spaCy pipeline with an increasing number of processes, to
+    measure how throughput and memory usage scale with the number of cores."""
+    if not max_processes:
+        max_processes = psutil.cpu_count(logical=False) or psutil.cpu_count()
+    log_scaling = create_scaling_logger(result_dir)
+    baseline_wps = None
+    for n_process in _process_counts(max_processes):
+        with MemoryMonitor() as monitor:
+            start = timeit.default_timer()
+            nlp_function(iter(corpus), batch_size, n_process=n_process)
+            end = timeit.default_timer()
+        s = end - start
+        if baseline_wps is None:
+            baseline_wps = corpus.words / s
+        log_scaling(
+            library="spacy",
+            name=name,
+            gpu=False,
+            n_process=n_process,
+            articles=corpus.articles,
+            words=corpus.words,
+            seconds=s,
+            baseline_wps=baseline_wps,
+            main_mb=monitor.peak_main / MB,
+            worker_mb=monitor.peak_child / MB,
+            total_mb=monitor.peak_total / MB,
+        )
+
+
+def _run_length_buckets(
+    nlp_function: Callable,
+    result_dir: Path,
+    library: str,
+    name: str,
+    gpu: bool,
+    txt_dir: Path,
+    n_texts: int,
+    batch_size: int,
+    sort_window: int,
+    boundaries: List[int],
+):
+    """Time the model separately on the texts in each range of lengths (in
+    words) delimited by the boundaries, with up to n_texts texts per range."""
+    log_bucket = create_length_bucket_logger(result_dir)
+    for min_words, max_words in zip([0, *boundaries], [*boundaries, 0]):
+        corpus = Corpus(txt_dir, limit=n_texts, min_words=min_words, max_words=max_words)
+        bucket = f"{corpus.min_words}-{max_words - 1}" if max_words else f"{corpus.min_words}+"
+        if corpus.is_empty():
+            msg.info(f"No texts with {bucket} words")
+            continue
+        start = timeit.default_timer()
+        nlp_function(iter(corpus), batch_size)
+        end = timeit.default_timer()
+        log_bucket(
+            library=library,
+            name=name,
+            gpu=gpu,
+            sort_window=sort_window,
+            bucket=bucket,
+            articles=corpus.articles,
+            words=corpus.words,
+            seconds=end - start,
+        )
+
+
+def _run_concurrency(
+    nlp_function: Callable,
+    result_dir: Path,
+    library: str,
+    name: str,
+    gpu: bool,
+    corpus: Corpus,
+    batch_size: int,
+    levels: List[int],
+    request_size: int,
+    use_asyncio: bool,
+    asyncio_threads: int,
+):
+    """Share the loaded model between an increasing number of concurrent
+    callers, each sending small requests of request_size texts, and measure
+    the aggregate throughput and the latency of the requests. With asyncio,
+    the callers share a pool of asyncio_threads threads."""
+    log_concurrency = create_concurrency_logger(result_dir)
+    process = functools.partial(nlp_function, batch_size=batch_size)
+    if use_asyncio:
+        hammer = functools.partial(hammer_asyncio, n_threads=asyncio_threads)
+        mode = f"asyncio/{asyncio_threads}"
+    else:
+        hammer = hammer_threads
+        mode = "threads"
+    for level in levels:
+        requests = minibatch(iter(corpus), size=request_size)
+        stats = hammer(process, requests, level)
+        log_concurrency(
+            library=library,
+            name=name,
+            gpu=gpu,
+            mode=mode,
+            concurrency=level,
+            request_size=request_size,
+            articles=corpus.articles,
+            stats=stats,
+        )
+
+
+def _tune_batch_size(
+    nlp_function: Callable,
+    result_dir: Path,
+    library: str,
+    name: str,
+    gpu: bool,
+    corpus: Corpus,
+    min_batch_size: int,
+    max_batch_size: int,
+):
+    """Measure the throughput for a range of batch sizes and record the best one.
+    For the raw transformer runner, batches limited by a budget of padded tokens
+    are tried as well."""
+    settings = [("texts", size) for size in _powers_of_two(min_batch_size, max_batch_size)]
+    if library == "hf_trf":
+        settings.extend(("tokens", budget) for budget in TUNE_TOKEN_BUDGETS)
+    log_batch_size = create_batch_size_logger(result_dir)
+    curve = []
+    for batch_by, size in settings:
+        if batch_by == "tokens":
+            # The batch size is only the window of texts tokenized at once here
+            run = functools.partial(nlp_function, max_tokens=size)
+            effective_size = size
+            size = DEFAULT_BATCH_SIZE
+        else:
+            run = nlp_function
+            effective_size = max(1, size // HF_BATCH_DIVISOR) if library == "hf_trf" else size
+        start = timeit.default_timer()
+        token_counts = run(iter(corpus), size)
+        end = timeit.default_timer()
+        s = end - start
+        log_batch_size(
+            library=library,
+            name=name,
+            gpu=gpu,
+            batch_by=batch_by,
+            batch_size=size,
+            effective_size=effective_size,
+            articles=corpus.articles,
+            words=corpus.words,
+            seconds=s,
+            token_counts=token_counts,
+        )
+        curve.append(
+            {"batch_by": batch_by, "batch_size": size, "effective_size": effective_size, "wps": corpus.words / s}
+        )
+    best = max(curve, key=lambda point: point["wps"])
+    msg.good(
+        f"Best setting for {name}: batch by {best['batch_by']}, "
+        f"--batch-size {best['batch_size']}"
+        + (f" --max-tokens {best['effective_size']}" if best["batch_by"] == "tokens" else "")
+        + f" ({best['wps'] / 1000:.1f}k WPS)"
+    )
+    best_file = update_best_batch_sizes(result_dir, library, name, gpu, best, curve)
+    msg.text(f"Updated {best_file}")
+
+
+def _powers_of_two(minimum: int, maximum: int) -> List[int]:
+    """Powers of two from the smallest one >= minimum up to maximum."""
+    values = []
+    value = 1
+    while value <= maximum:
+        if value >= minimum:
+            values.append(value)
+        value *= 2
+    return values
+
+
+def _process_counts(max_processes: int) -> List[int]:
+    """Powers of two up to (and always including) max_processes, starting at 1."""
+    counts = []
+    n_process = 1
+    while n_process < max_processes:
+        counts.append(n_process)
+        n_process *= 2
+    counts.append(max_processes)
+    return counts
+
+
+def _get_run(
+    library: str, name: str, gpu: bool, component_stats: Optional[ComponentStats] = None
+) -> Callable[[List[str]], None]:
     if library == "spacy":
-        return _run_spacy_model(name, gpu)
+        return _run_spacy_model(name, gpu, component_stats=component_stats)
 
     if library == "stanza":
         return _run_stanza_model(name, gpu)
@@ -80,20 +448,48 @@ def _get_run(library: str, name: str, gpu: bool) -> Callable[[List[str]], None]:
     )
 
 
-def _run_spacy_model(name: str, gpu: bool) -> Callable[[List[str]], None]:
-    """Run a pretrained spaCy pipeline"""
+def _run_spacy_model(
+    name: str, gpu: bool, component_stats: Optional[ComponentStats] = None
+) -> Callable[[List[str]], None]:
+    """Run a pretrained spaCy pipeline, optionally timing each component"""
     import spacy
 
     if gpu:
         spacy.require_gpu(0)
     nlp = spacy.load(name)
-
-    def run(texts: List[str], batch_size: int):
-        list(nlp.pipe(texts, batch_size=batch_size))
+    if component_stats is not None:
+        instrument_pipeline(nlp, component_stats)
+    has_transformer = "transformer" in nlp.pipe_names
+
+    def run(texts: List[str], batch_size: int, n_process: int = 1, sort_window: int = 0):
+        if sort_window:
+            process = functools.partial(nlp.pipe, batch_size=batch_size, n_process=n_process)
+            docs = process_sorted_by_length(process, texts, sort_window)
+        else:
+            docs = nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+        # The docs are consumed as they come, so the memory used doesn't grow
+        # with the number of texts
+        counts = {"tokens": 0, "padded_tokens": 0}
+        for doc in docs:
+            if has_transformer:
+                _count_wordpieces(doc, counts)
+        if has_transformer:
+            return counts
 
     return run
 
 
+def _count_wordpieces(doc, counts: Dict[str, int]) -> None:
+    """Add the wordpiece tokens the transformer of a spaCy pipeline processed
+    for the doc to the counts, with and without the padding of the spans."""
+    trf_data = getattr(doc._, "trf_data", None)
+    if trf_data is None:
+        return
+    attention_mask = trf_data.wordpieces.attention_mask
+    counts["tokens"] += int(attention_mask.sum())
+    counts["padded_tokens"] += int(attention_mask.size)
+
+
 def _run_transformer_model(name: str, gpu) -> Callable[[List[str]], None]:
     """Run bare transformer model, outputting raw hidden-states"""
     from transformers import AutoTokenizer, AutoModel
@@ -107,18 +503,81 @@ def _run_transformer_model(name: str, gpu) -> Callable[[List[str]], None]:
     if gpu:
         transformer = transformer.cuda()
 
-    def run(texts: List[str], batch_size: int):
-        transformer.eval()
-        for batch in minibatch(texts, batch_size // 20):
-            batch = tokenizer(batch, padding=True, truncation=True, return_tensors="pt")
+    def forward(texts: Iterable[str], batch_size: int, max_tokens: int, counts: Dict[str, int]):
+        """Yield the hidden state of the first token of each text, in order."""
+        if max_tokens:
+            batches = _token_budget_batches(tokenizer, texts, batch_size, max_tokens)
+        else:
+            batches = _fixed_size_batches(tokenizer, texts, max(1, batch_size // HF_BATCH_DIVISOR))
+        # Token budget batches are sorted by length within their window, so
+        # hold on to the outputs until the next text in order is done
+        pending = {}
+        next_position = 0
+        for positions, batch in batches:
+            counts["tokens"] += int(batch["attention_mask"].sum())
+            counts["padded_tokens"] += batch["input_ids"].numel()
             if gpu:
                 batch["input_ids"] = batch["input_ids"].to("cuda:0")
                 batch["attention_mask"] = batch["attention_mask"].to("cuda:0")
-            transformer(**batch)
+            with torch.no_grad():
+                hidden = transformer(**batch).last_hidden_state[:, 0]
+            pending.update(zip(positions, hidden))
+            while next_position in pending:
+                yield pending.pop(next_position)
+                next_position += 1
+
+    def run(texts: List[str], batch_size: int, max_tokens: int = 0, sort_window: int = 0) -> Dict[str, int]:
+        transformer.eval()
+        counts = {"tokens": 0, "padded_tokens": 0}
+        process = functools.partial(forward, batch_size=batch_size, max_tokens=max_tokens, counts=counts)
+        if sort_window:
+            outputs = process_sorted_by_length(process, texts, sort_window)
+        else:
+            outputs = process(texts)
+        for _ in outputs:
+            pass
+        return counts
 
     return run
 
 
+def _fixed_size_batches(tokenizer, texts: Iterable[str], size: int):
+    """Tokenize batches of `size` texts, padded to the longest text. Yields the
+    positions of the texts in the stream together with each batch."""
+    start = 0
+    for texts_batch in minibatch(texts, size):
+        batch = tokenizer(texts_batch, padding=True, truncation=True, return_tensors="pt")
+        yield range(start, start + len(texts_batch)), batch
+        start += len(texts_batch)
+
+
+def _token_budget_batches(tokenizer, texts: Iterable[str], window: int, max_tokens: int):
+    """Tokenize the texts in windows of `window` texts, sort each window by the
+    number of tokens, and pack the texts into batches so that the padded size
+    of each batch (number of texts times the longest text) stays within
+    max_tokens. Sorting puts texts of similar length together, which minimises
+    the compute spent on padding. A text that is longer than the budget on its
+    own forms a batch by itself. Yields the positions of the texts in the
+    stream together with each batch."""
+    start = 0
+    for chunk in minibatch(texts, window):
+        encodings = tokenizer(chunk, truncation=True)["input_ids"]
+        order = sorted(range(len(encodings)), key=lambda i: len(encodings[i]))
+        positions = []
+        batch = []
+        for i in order:
+            padded_length = len(encodings[i])
+            if batch and padded_length * (len(batch) + 1) > max_tokens:
+                yield positions, tokenizer.pad({"input_ids": batch}, return_tensors="pt")
+                positions = []
+                batch = []
+            positions.append(start + i)
+            batch.append(encodings[i])
+        if batch:
+            yield positions, tokenizer.pad({"input_ids": batch}, return_tensors="pt")
+        start += len(encodings)
+
+
 def _run_stanza_model(name: str, gpu: bool) -> Callable[[List[str]], None]:
     """Run a Stanza pretrained model"""
     import stanza
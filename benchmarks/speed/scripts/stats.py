@@ -0,0 +1,22 @@
+from typing import List, Optional, Tuple
+import statistics
+
+# Two-sided 95% critical values of Student's t distribution by degrees of
+# freedom. Between the listed values and beyond the last one, the next lower
+# one is used, which errs on the side of a wider interval.
+T_95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262, 10: 2.228, 15: 2.131, 20: 2.086, 30: 2.042}
+
+
+def t_critical(degrees_of_freedom: int) -> float:
+    return T_95[max(df for df in T_95 if df <= degrees_of_freedom)]
+
+
+def summarize(values: List[float]) -> Tuple[float, Optional[float], Optional[float]]:
+    """Return the mean, the sample standard deviation and the half-width of the
+    95% confidence interval of the mean. The spread can't be estimated from a
+    single value, so it's None in that case."""
+    mean = statistics.mean(values)
+    if len(values) < 2:
+        return mean, None, None
+    stdev = statistics.stdev(values)
+    return mean, stdev, t_critical(len(values) - 1) * stdev / len(values) ** 0.5
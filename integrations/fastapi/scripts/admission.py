@@ -0,0 +1,109 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+# Window in seconds over which the throughput is measured to estimate how long
+# callers should wait before retrying
+THROUGHPUT_WINDOW = 10.0
+MAX_RETRY_AFTER = 30
+
+
+class AdmissionController:
+    """Limits on the documents and characters in flight for one model. A limit
+    of 0 means no limit. Requests are either admitted right away or rejected
+    (try_acquire), or wait until there's capacity (acquire).
+    """
+
+    def __init__(self, max_docs: int = 0, max_chars: int = 0):
+        self.max_docs = max_docs
+        self.max_chars = max_chars
+        self.docs = 0
+        self.chars = 0
+        self.n_admitted = 0
+        self.n_rejected = 0
+        self.n_waiting = 0
+        # Completion times and characters of recent requests
+        self._completed: Deque[Tuple[float, int]] = deque()
+        self._released: Optional[asyncio.Event] = None
+
+    def too_large(self, docs: int, chars: int) -> bool:
+        """Whether the work can never be admitted, because it exceeds the
+        limits on its own."""
+        too_many_docs = self.max_docs and docs > self.max_docs
+        too_many_chars = self.max_chars and chars > self.max_chars
+        return bool(too_many_docs or too_many_chars)
+
+    def fits(self, docs: int, chars: int) -> bool:
+        if self.max_docs and self.docs + docs > self.max_docs:
+            return False
+        return not (self.max_chars and self.chars + chars > self.max_chars)
+
+    def try_acquire(self, docs: int, chars: int) -> bool:
+        """Admit the work if it fits within the limits."""
+        if not self.fits(docs, chars):
+            self.n_rejected += 1
+            return False
+        self._add(docs, chars)
+        return True
+
+    async def acquire(self, docs: int, chars: int) -> None:
+        """Wait until the work fits within the limits and admit it. Work that's
+        too large for the limits is admitted once nothing else is in flight."""
+        self.n_waiting += 1
+        try:
+            while not (self.fits(docs, chars) or self.docs == 0):
+                if self._released is None:
+                    self._released = asyncio.Event()
+                await self._released.wait()
+        finally:
+            self.n_waiting -= 1
+        self._add(docs, chars)
+
+    def _add(self, docs: int, chars: int) -> None:
+        self.docs += docs
+        self.chars += chars
+        self.n_admitted += 1
+
+    def release(self, docs: int, chars: int) -> None:
+        self._completed.append((time.monotonic(), chars))
+        self.cancel(docs, chars)
+
+    def cancel(self, docs: int, chars: int) -> None:
+        """Give back admitted work that wasn't processed, so it doesn't count
+        towards the throughput."""
+        self.docs -= docs
+        self.chars -= chars
+        if self._released is not None:
+            # Wake up everyone waiting, they check again whether they fit
+            self._released.set()
+            self._released = None
+
+    def throughput(self) -> float:
+        """Characters per second completed over the recent window."""
+        now = time.monotonic()
+        while self._completed and self._completed[0][0] < now - THROUGHPUT_WINDOW:
+            self._completed.popleft()
+        if not self._completed:
+            return 0.0
+        return sum(chars for _, chars in self._completed) / THROUGHPUT_WINDOW
+
+    def retry_after(self) -> int:
+        """Estimate the seconds until the work in flight has been processed."""
+        throughput = self.throughput()
+        if not throughput:
+            return 1
+        return min(max(math.ceil(self.chars / throughput), 1), MAX_RETRY_AFTER)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "docs_in_flight": self.docs,
+            "chars_in_flight": self.chars,
+            "max_docs": self.max_docs,
+            "max_chars": self.max_chars,
+            "waiting": self.n_waiting,
+            "admitted": self.n_admitted,
+            "rejected": self.n_rejected,
+            "chars_per_second": round(self.throughput(), 1),
+        }
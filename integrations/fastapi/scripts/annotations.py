@@ -0,0 +1,80 @@
+from enum import Enum
+from typing import Dict, Iterable, List, Set, Tuple
+from spacy.language import Language
+
+
+class Annotation(str, Enum):
+    # Enum of the annotations a request can ask for. Only the components needed
+    # to predict them are run.
+    ents = "ents"
+    sents = "sents"
+    tags = "tags"
+    pos = "pos"
+    lemmas = "lemmas"
+    deps = "deps"
+    morphs = "morphs"
+
+
+# Attributes to set for each annotation, as declared by the components in the
+# "assigns" of their factory meta
+ANNOTATION_ATTRS = {
+    Annotation.ents: ["doc.ents", "token.ent_iob", "token.ent_type"],
+    Annotation.sents: ["doc.sents", "token.is_sent_start"],
+    Annotation.tags: ["token.tag"],
+    Annotation.pos: ["token.pos"],
+    Annotation.lemmas: ["token.lemma"],
+    Annotation.deps: ["token.dep", "token.head"],
+    Annotation.morphs: ["token.morph"],
+}
+# Attributes assigned and required by components of the trained pipelines that
+# aren't declared in their factory meta, by factory name. In the English
+# pipelines, the attribute_ruler maps the tags to POS and morphology and the
+# rule-based lemmatizer relies on the POS.
+UNDECLARED_ASSIGNS = {"attribute_ruler": ["token.pos", "token.morph", "token.lemma"]}
+UNDECLARED_REQUIRES = {"attribute_ruler": ["token.tag"], "lemmatizer": ["token.pos"]}
+
+_DISABLED: Dict[Tuple[str, Tuple[Annotation, ...]], List[str]] = {}
+
+
+def normalize_annotations(annotations: Iterable[Annotation]) -> Tuple[Annotation, ...]:
+    """Return the annotations in a canonical order without duplicates, to use
+    them as a key."""
+    return tuple(sorted(set(annotations)))
+
+
+def get_required_pipes(nlp: Language, annotations: Iterable[Annotation]) -> List[str]:
+    """Return the names of the components needed to predict the annotations,
+    in pipeline order. These are the components that assign the annotations,
+    the components assigning what those require and the embedding components
+    they listen to."""
+    needed: Set[str] = set()
+    for annotation in annotations:
+        needed.update(ANNOTATION_ATTRS[annotation])
+    required = set()
+    # A component's requirements are assigned by components before it, so
+    # going through the pipeline backwards picks them up as well
+    for name in reversed(nlp.pipe_names):
+        meta = nlp.get_pipe_meta(name)
+        assigns = set(meta.assigns) | set(UNDECLARED_ASSIGNS.get(meta.factory, []))
+        if assigns & needed:
+            required.add(name)
+            needed.update(meta.requires)
+            needed.update(UNDECLARED_REQUIRES.get(meta.factory, []))
+    for name, component in nlp.pipeline:
+        # Shared tok2vec and transformer components
+        listeners = getattr(component, "listening_components", [])
+        if required.intersection(listeners):
+            required.add(name)
+    return [name for name in nlp.pipe_names if name in required]
+
+
+def get_disabled_pipes(
+    model_name: str, nlp: Language, annotations: Tuple[Annotation, ...]
+) -> List[str]:
+    """Return the components of the model that aren't needed for the
+    annotations. The result is cached per model and annotations."""
+    key = (model_name, annotations)
+    if key not in _DISABLED:
+        required = get_required_pipes(nlp, annotations)
+        _DISABLED[key] = [name for name in nlp.pipe_names if name not in required]
+    return _DISABLED[key]
@@ -0,0 +1,224 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import srsly
+from starlette.concurrency import run_in_threadpool
+
+MB = 1024 * 1024
+# Maximum number of keys looked up in one query, to stay below SQLite's limit on
+# the number of parameters
+DISK_QUERY_SIZE = 500
+# When the disk tier is over its size limit, evict entries until it's back to
+# this fraction of the limit, so we don't have to evict on every write
+DISK_EVICT_TO = 0.9
+
+
+def cache_key(*parts: str) -> str:
+    """Content-addressed key for the result of processing a text, e.g. from
+    the model name, model version and text."""
+    return hashlib.sha256("\0".join(parts).encode("utf8")).hexdigest()
+
+
+class MemoryCache:
+    """In-memory LRU cache with a size limit in bytes. The size of an entry is
+    estimated from its serialized JSON."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self._entries: "OrderedDict[str, Tuple[Any, int]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def set(self, key: str, value: Any, size: int) -> None:
+        if key in self._entries:
+            self.size -= self._entries.pop(key)[1]
+        self._entries[key] = (value, size)
+        self.size += size
+        while self.size > self.max_size and self._entries:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+
+
+class DiskCache:
+    """Cache stored in an SQLite database, evicting the least recently used
+    entries once it's over its size limit in bytes. The database can be shared
+    by several server processes, so the number and size of the entries are
+    kept in the database too, and updated in the same transactions as the
+    entries."""
+
+    def __init__(self, path: Path, max_size: int):
+        self.path = path
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache "
+            "(key TEXT PRIMARY KEY, value BLOB, size INTEGER, accessed REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS accessed ON cache (accessed)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS totals "
+            "(id INTEGER PRIMARY KEY CHECK (id = 0), count INTEGER, size INTEGER)"
+        )
+        self._db.execute(
+            "INSERT OR IGNORE INTO totals "
+            "SELECT 0, COUNT(*), IFNULL(SUM(size), 0) FROM cache"
+        )
+        self._db.commit()
+        # Totals as of the last write of this process
+        self.count, self.size = self._read_totals()
+
+    def _read_totals(self) -> Tuple[int, int]:
+        return self._db.execute("SELECT count, size FROM totals").fetchone()
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, bytes]:
+        with self._lock:
+            rows = []
+            for i in range(0, len(keys), DISK_QUERY_SIZE):
+                query_keys = keys[i : i + DISK_QUERY_SIZE]
+                placeholders = ",".join("?" * len(query_keys))
+                rows.extend(
+                    self._db.execute(
+                        f"SELECT key, value FROM cache WHERE key IN ({placeholders})",
+                        query_keys,
+                    )
+                )
+            if rows:
+                self._db.executemany(
+                    "UPDATE cache SET accessed = ? WHERE key = ?",
+                    [(time.time(), key) for key, _ in rows],
+                )
+                self._db.commit()
+        return dict(rows)
+
+    def set_many(self, entries: Sequence[Tuple[str, bytes]]) -> None:
+        with self._lock:
+            # Hold the write lock of the database for the whole update, so
+            # other processes can't change the totals in the meantime
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                count = 0
+                size = 0
+                for key, value in entries:
+                    row = self._db.execute(
+                        "SELECT size FROM cache WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row is not None:
+                        size -= row[0]
+                        count -= 1
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                        (key, value, len(value), now),
+                    )
+                    size += len(value)
+                    count += 1
+                self._update_totals(count, size)
+                self.count, self.size = self._read_totals()
+                if self.size > self.max_size:
+                    self._evict()
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+
+    def _update_totals(self, count: int, size: int) -> None:
+        self._db.execute(
+            "UPDATE totals SET count = count + ?, size = size + ?", (count, size)
+        )
+
+    def _evict(self) -> None:
+        rows = self._db.execute("SELECT key, size FROM cache ORDER BY accessed")
+        evicted = []
+        evicted_size = 0
+        for key, size in rows:
+            if self.size - evicted_size <= self.max_size * DISK_EVICT_TO:
+                break
+            evicted.append((key,))
+            evicted_size += size
+        self._db.executemany("DELETE FROM cache WHERE key = ?", evicted)
+        self._update_totals(-len(evicted), -evicted_size)
+        self.count -= len(evicted)
+        self.size -= evicted_size
+
+
+class ResponseCache:
+    """Cache of the data returned for processed texts, with an in-memory LRU
+    tier and an optional on-disk tier behind it. Entries found on disk are
+    promoted to the memory tier."""
+
+    def __init__(
+        self, memory_size: int, disk_path: Optional[Path] = None, disk_size: int = 0
+    ):
+        self.memory = MemoryCache(memory_size)
+        self.disk = DiskCache(disk_path, disk_size) if disk_path else None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.write_errors = 0
+
+    async def get_many(self, keys: List[str]) -> List[Optional[Any]]:
+        """Return the cached values for the keys, or None if not cached."""
+        values = [self.memory.get(key) for key in keys]
+        self.memory_hits += sum(value is not None for value in values)
+        if self.disk is not None:
+            missing = [key for key, value in zip(keys, values) if value is None]
+            if missing:
+                # Don't block the event loop with the database
+                found = await run_in_threadpool(self.disk.get_many, missing)
+                for i, key in enumerate(keys):
+                    if values[i] is None and key in found:
+                        data = found[key]
+                        values[i] = srsly.json_loads(data)
+                        self.memory.set(key, values[i], len(data))
+                        self.disk_hits += 1
+        self.misses += sum(value is None for value in values)
+        return values
+
+    async def set_many(self, entries: List[Tuple[str, Any]]) -> None:
+        """Cache the values for the keys. Caching is best-effort: if the disk
+        tier can't be written, e.g. because the database is locked by another
+        process for too long, the entries are only kept in memory."""
+        serialized = []
+        for key, value in entries:
+            data = srsly.json_dumps(value).encode("utf8")
+            self.memory.set(key, value, len(data))
+            serialized.append((key, data))
+        if self.disk is not None and serialized:
+            try:
+                await run_in_threadpool(self.disk.set_many, serialized)
+            except Exception as e:
+                self.write_errors += 1
+                print(f"Couldn't write {len(serialized)} entries to the cache: {e}")
+
+    def status(self) -> Dict[str, Any]:
+        """Return the hit rates and sizes of the cache tiers."""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        status = {
+            "lookups": lookups,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "write_errors": self.write_errors,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0,
+            "memory_entries": len(self.memory),
+            "memory_mb": round(self.memory.size / MB, 2),
+        }
+        if self.disk is not None:
+            status["disk_entries"] = self.disk.count
+            status["disk_mb"] = round(self.disk.size / MB, 2)
+        return status
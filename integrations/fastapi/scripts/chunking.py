@@ -0,0 +1,88 @@
+import re
+from typing import Any, Dict, List, Tuple
+
+# Boundaries to split long texts at, in order of preference: paragraphs,
+# sentences and whitespace. The boundary is kept with the text before it.
+SPLITTERS = [
+    re.compile(r"\n\s*\n"),
+    re.compile(r"(?<=[.!?])\s+"),
+    re.compile(r"\s+"),
+]
+
+
+def _segments(
+    text: str, start: int, end: int, max_chars: int, level: int = 0
+) -> List[Tuple[int, int]]:
+    if end - start <= max_chars:
+        return [(start, end)]
+    if level == len(SPLITTERS):
+        # No boundary to split at, so cut the text
+        return [(i, min(i + max_chars, end)) for i in range(start, end, max_chars)]
+    matches = SPLITTERS[level].finditer(text, start, end)
+    bounds = [start] + [m.end() for m in matches if start < m.end() < end] + [end]
+    segments = []
+    for segment_start, segment_end in zip(bounds, bounds[1:]):
+        segments.extend(
+            _segments(text, segment_start, segment_end, max_chars, level + 1)
+        )
+    return segments
+
+
+def split_text(text: str, max_chars: int) -> List[Tuple[int, str]]:
+    """Split a text into chunks of at most max_chars characters, aligned with
+    paragraphs where possible and with sentences or whitespace otherwise.
+    Returns the start offset and text of each chunk. The chunks cover the
+    whole text, so joining them gives back the original text.
+    """
+    if len(text) <= max_chars:
+        return [(0, text)]
+    segments = _segments(text, 0, len(text), max_chars)
+    # Put as many consecutive segments into a chunk as fit
+    chunks = []
+    chunk_start, chunk_end = segments[0]
+    for start, end in segments[1:]:
+        if end - chunk_start <= max_chars:
+            chunk_end = end
+        else:
+            chunks.append((chunk_start, chunk_end))
+            chunk_start, chunk_end = start, end
+    chunks.append((chunk_start, chunk_end))
+    return [(start, text[start:end]) for start, end in chunks]
+
+
+def merge_chunk_data(
+    text: str, chunks: List[Tuple[int, Dict[str, Any]]]
+) -> Dict[str, Any]:
+    """Merge the data returned by get_data for the chunks of a text, given
+    the start offset of each chunk. The character offsets of the entities,
+    sentences and tokens are moved to be relative to the original text, and
+    the token indices of the heads to be relative to all tokens. Other lists
+    are concatenated, and other values taken from the first chunk.
+    """
+    if len(chunks) == 1:
+        return chunks[0][1]
+    merged = {**chunks[0][1], "text": text}
+    for key, value in merged.items():
+        if isinstance(value, list):
+            merged[key] = []
+    n_tokens = 0
+    for offset, data in chunks:
+        for key, value in data.items():
+            if not isinstance(value, list):
+                continue
+            if key in ("ents", "sents", "tokens"):
+                value = [
+                    {
+                        **item,
+                        "start": item["start"] + offset,
+                        "end": item["end"] + offset,
+                    }
+                    for item in value
+                ]
+            if key == "tokens":
+                for item in value:
+                    if "head" in item:
+                        item["head"] += n_tokens
+            merged.setdefault(key, []).extend(value)
+        n_tokens += len(data.get("tokens", []))
+    return merged
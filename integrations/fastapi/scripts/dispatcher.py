@@ -0,0 +1,190 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+import numpy
+
+# Upper bounds of the batch size histogram
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]
+# Number of recent queue waits used to compute the percentiles
+N_RECENT_WAITS = 1000
+
+
+@dataclass
+class _Request:
+    texts: List[str]
+    n_chars: int
+    future: asyncio.Future
+    enqueued: float
+
+
+class BatchDispatcher:
+    """Coalesce the texts of concurrent requests for one model into batches,
+    so the model can make use of batching even if clients only send one or
+    two texts at a time. A batch is dispatched once it reaches the maximum
+    number of texts or characters, or its oldest request has waited for
+    max_wait seconds. At most max_in_flight batches are processed at the same
+    time.
+
+    process_batch (Callable[[List[str]], Awaitable[List[Any]]]): Process a
+        batch of texts and return one result per text, in order.
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[List[str]], Awaitable[List[Any]]],
+        max_batch_size: int,
+        max_wait: float,
+        max_in_flight: int,
+        max_batch_chars: int = 0,
+    ):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_batch_chars = max_batch_chars
+        self.max_wait = max_wait
+        self.max_in_flight = max_in_flight
+        self._pending: Deque[_Request] = deque()
+        self._n_pending = 0
+        self._n_pending_chars = 0
+        self._n_in_flight = 0
+        # The asyncio objects are created in the running event loop on first use
+        self._task: Optional[asyncio.Task] = None
+        self._new_request: asyncio.Event
+        self._slots: asyncio.Semaphore
+        self.n_batches = 0
+        self.n_texts = 0
+        self.n_requests = 0
+        self.batch_sizes = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+        self.queue_waits: Deque[float] = deque(maxlen=N_RECENT_WAITS)
+
+    async def process(self, texts: List[str]) -> List[Any]:
+        """Process the texts as part of one or more batches and return the
+        results for the texts, in order."""
+        if not texts:
+            return []
+        if self._task is None:
+            self._new_request = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+            self._task = asyncio.ensure_future(self._dispatch())
+        loop = asyncio.get_event_loop()
+        futures = []
+        # Requests larger than a batch are split, so they can be processed in
+        # parallel and requests queued behind them don't wait for all of it
+        start = 0
+        while start < len(texts):
+            end = start + 1
+            n_chars = len(texts[start])
+            while end < len(texts) and self._fits(
+                end - start, n_chars, 1, len(texts[end])
+            ):
+                n_chars += len(texts[end])
+                end += 1
+            future = loop.create_future()
+            request = _Request(texts[start:end], n_chars, future, loop.time())
+            self._pending.append(request)
+            self._n_pending += len(request.texts)
+            self._n_pending_chars += n_chars
+            futures.append(future)
+            start = end
+        self._new_request.set()
+        results = await asyncio.gather(*futures)
+        return [result for part in results for result in part]
+
+    async def _dispatch(self) -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            while not self._pending:
+                self._new_request.clear()
+                await self._new_request.wait()
+            # Requests keep queuing up while all slots are busy, so the batches
+            # get larger under load
+            await self._slots.acquire()
+            deadline = self._pending[0].enqueued + self.max_wait
+            while not self._is_full(self._n_pending, self._n_pending_chars):
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                self._new_request.clear()
+                try:
+                    await asyncio.wait_for(self._new_request.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            batch = [self._pending.popleft()]
+            size = len(batch[0].texts)
+            n_chars = batch[0].n_chars
+            while self._pending and self._fits(
+                size, n_chars, len(self._pending[0].texts), self._pending[0].n_chars
+            ):
+                batch.append(self._pending.popleft())
+                size += len(batch[-1].texts)
+                n_chars += batch[-1].n_chars
+            self._n_pending -= size
+            self._n_pending_chars -= n_chars
+            self._record(batch, size, loop.time())
+            asyncio.ensure_future(self._process(batch))
+
+    def _is_full(self, size: int, n_chars: int) -> bool:
+        if size >= self.max_batch_size:
+            return True
+        return bool(self.max_batch_chars) and n_chars >= self.max_batch_chars
+
+    def _fits(self, size: int, n_chars: int, add_size: int, add_chars: int) -> bool:
+        """Whether texts can be added to a batch without exceeding the limits."""
+        if size + add_size > self.max_batch_size:
+            return False
+        return not self.max_batch_chars or n_chars + add_chars <= self.max_batch_chars
+
+    async def _process(self, batch: List[_Request]) -> None:
+        self._n_in_flight += 1
+        try:
+            texts = [text for request in batch for text in request.texts]
+            results = await self.process_batch(texts)
+        except Exception as e:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+        else:
+            i = 0
+            for request in batch:
+                # The caller may have gone away in the meantime
+                if not request.future.done():
+                    request.future.set_result(results[i : i + len(request.texts)])
+                i += len(request.texts)
+        finally:
+            self._n_in_flight -= 1
+            self._slots.release()
+
+    def _record(self, batch: List[_Request], size: int, now: float) -> None:
+        self.n_batches += 1
+        self.n_texts += size
+        self.n_requests += len(batch)
+        bucket = next(
+            (i for i, bound in enumerate(BATCH_SIZE_BUCKETS) if size <= bound),
+            len(BATCH_SIZE_BUCKETS),
+        )
+        self.batch_sizes[bucket] += 1
+        self.queue_waits.extend(now - request.enqueued for request in batch)
+
+    def status(self) -> Dict[str, Any]:
+        """Return the current queue depth and the batching statistics."""
+        bounds = [str(bound) for bound in BATCH_SIZE_BUCKETS] + ["+Inf"]
+        status = {
+            "queued_texts": self._n_pending,
+            "queued_requests": len(self._pending),
+            "in_flight_batches": self._n_in_flight,
+            "batches": self.n_batches,
+            "requests": self.n_requests,
+            "texts": self.n_texts,
+            "mean_batch_size": self.n_texts / self.n_batches if self.n_batches else 0,
+            "batch_sizes": dict(zip(bounds, self.batch_sizes)),
+        }
+        if self.queue_waits:
+            waits = numpy.asarray(self.queue_waits) * 1000
+            for q in (50, 90, 99):
+                status[f"queue_wait_p{q}_ms"] = float(numpy.percentile(waits, q))
+            status["queue_wait_max_ms"] = float(waits.max())
+        return status
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
@@ -0,0 +1,65 @@
+from typing import Iterable, List, Optional, Tuple
+from spacy.tokens import Doc, DocBin
+
+from .annotations import Annotation
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+DOCBIN = "application/x-spacy-docbin"
+# Alternative media types clients may use for the formats
+ALIASES = {"application/x-msgpack": MSGPACK, "*/*": JSON, "application/*": JSON}
+FORMATS = [JSON, MSGPACK, DOCBIN]
+# Token attributes to store in a DocBin for each annotation, in addition to the
+# ORTH and SPACY attributes needed to restore the texts
+DOCBIN_ATTRS = {
+    Annotation.ents: ["ENT_IOB", "ENT_TYPE", "ENT_KB_ID"],
+    Annotation.sents: ["SENT_START"],
+    Annotation.tags: ["TAG"],
+    Annotation.pos: ["POS"],
+    Annotation.lemmas: ["LEMMA"],
+    Annotation.deps: ["HEAD", "DEP"],
+    Annotation.morphs: ["MORPH"],
+}
+
+
+def negotiate_format(accept: Optional[str]) -> str:
+    """Return the response format to use given the Accept header of the
+    request, taking the quality values into account. Falls back to JSON if
+    none of the accepted media types is supported."""
+    if not accept:
+        return JSON
+    candidates = []
+    for i, part in enumerate(accept.split(",")):
+        media_type, *params = [value.strip() for value in part.split(";")]
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        media_type = ALIASES.get(media_type.lower(), media_type.lower())
+        if media_type in FORMATS and quality > 0:
+            # Prefer the earlier media type if the quality is the same
+            candidates.append((-quality, i, media_type))
+    return min(candidates)[2] if candidates else JSON
+
+
+def docs_to_docbin(docs: Iterable[Doc], annotations: Tuple[Annotation, ...]) -> bytes:
+    """Serialize the docs with the attributes of the annotations."""
+    attrs = [attr for annotation in annotations for attr in DOCBIN_ATTRS[annotation]]
+    doc_bin = DocBin(attrs=attrs, store_user_data=False)
+    for doc in docs:
+        doc_bin.add(doc)
+    return doc_bin.to_bytes()
+
+
+def merge_docbins(docbins: List[bytes]) -> bytes:
+    """Merge serialized DocBins with the same attributes into one."""
+    if len(docbins) == 1:
+        return docbins[0]
+    merged = DocBin().from_bytes(docbins[0])
+    for data in docbins[1:]:
+        merged.merge(DocBin().from_bytes(data))
+    return merged.to_bytes()
@@ -0,0 +1,317 @@
+from typing import Any, Dict, Iterator, List, Tuple
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+import random
+import socket
+import threading
+import time
+import timeit
+import numpy
+from pydantic import BaseModel
+import requests
+import srsly
+import typer
+from wasabi import msg
+
+# Statuses the service uses to shed load, which are counted as rejections
+# rather than errors
+REJECTED_STATUSES = (429, 503)
+# Made-up words for the texts if the example data isn't available
+SYNTHETIC_WORDS = (
+    "the a of and to in Apple Google London Berlin Monday company city said "
+    "announced new report market year people government film story character "
+    "returns finds meets leaves"
+).split()
+
+
+class Scenario(BaseModel):
+    """A mix of requests to send to the API. Each request picks one of the
+    models at random and sends between min_articles and max_articles articles
+    of between min_chars and max_chars characters each."""
+
+    name: str
+    requests: int = 100
+    concurrency: int = 8
+    min_articles: int = 1
+    max_articles: int = 1
+    min_chars: int = 50
+    max_chars: int = 1000
+    models: List[str] = ["en_core_web_sm"]
+    annotations: List[str] = ["ents"]
+    # Media type to ask for via the Accept header
+    accept: str = "application/json"
+    chunking: bool = False
+    # Send the articles to /process/stream as NDJSON instead of /process/
+    stream: bool = False
+    # Share of the articles drawn from a small pool of repeated texts, to see
+    # the effect of the cache
+    duplicates: float = 0.0
+    # Requests sent before measuring, e.g. so the models are loaded
+    warmup: int = 0
+
+
+class ScenarioResult:
+    """Latencies and outcomes of the requests of one scenario."""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.statuses: Counter = Counter()
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+        self.docs = 0
+        self.chars = 0
+        self.seconds = 0.0
+
+    def add(self, seconds: float, status: int, docs: int, chars: int) -> None:
+        self.requests += 1
+        self.statuses[status] += 1
+        if status in REJECTED_STATUSES:
+            self.rejected += 1
+        elif status != 200:
+            self.errors += 1
+        else:
+            # Only completed requests count towards the latency and throughput
+            self.latencies.append(seconds)
+            self.docs += docs
+            self.chars += chars
+
+    def to_dict(self) -> Dict[str, Any]:
+        seconds = self.seconds or 1.0
+        result = {
+            "requests": self.requests,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "error_rate": self.errors / self.requests if self.requests else 0.0,
+            "rejection_rate": self.rejected / self.requests if self.requests else 0.0,
+            "statuses": {str(status): n for status, n in sorted(self.statuses.items())},
+            "seconds": self.seconds,
+            "requests_per_second": (self.requests - self.errors - self.rejected)
+            / seconds,
+            "docs_per_second": self.docs / seconds,
+            "chars_per_second": self.chars / seconds,
+        }
+        if self.latencies:
+            latencies = numpy.asarray(self.latencies) * 1000
+            for q in (50, 90, 99):
+                result[f"latency_p{q}_ms"] = float(numpy.percentile(latencies, q))
+            result["latency_max_ms"] = float(latencies.max())
+        return result
+
+
+def main(
+    scenarios: Path,
+    output: Path,
+    url: str = typer.Option("", help="Base URL of a running server"),
+    data: Path = Path("assets/data.jsonl"),
+    seed: int = 0,
+):
+    """Run the load-test scenarios defined in a YAML file against the API and
+    save the throughput, latency percentiles and error rates per scenario as
+    JSON. Without --url, the app is served by uvicorn in this process, using
+    the SPACY_API_ environment variables as usual. The scenarios run in
+    order, so later ones see the models, cache and statistics left behind by
+    earlier ones.
+    """
+    config = srsly.read_yaml(scenarios)
+    to_run = [Scenario(**scenario) for scenario in config["scenarios"]]
+    sentences = read_sentences(data)
+    rng = random.Random(seed)
+    results = {}
+    with serve(url) as base_url:
+        for scenario in to_run:
+            msg.info(f"Running scenario '{scenario.name}'")
+            results[scenario.name] = run_scenario(base_url, scenario, sentences, rng)
+            results[scenario.name]["server"] = get_server_stats(base_url)
+    header = ["Scenario", "Req/s", "Docs/s", "p50 ms", "p99 ms", "Errors", "Rejected"]
+    rows = [
+        (
+            name,
+            f"{result['requests_per_second']:.1f}",
+            f"{result['docs_per_second']:.1f}",
+            f"{result.get('latency_p50_ms', 0):.1f}",
+            f"{result.get('latency_p99_ms', 0):.1f}",
+            f"{result['error_rate']:.1%}",
+            f"{result['rejection_rate']:.1%}",
+        )
+        for name, result in results.items()
+    ]
+    msg.table(rows, header=header, divider=True)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    srsly.write_json(output, results)
+    msg.good(f"Saved results to {output}")
+
+
+def read_sentences(path: Path) -> List[str]:
+    """Read the texts of the example data to build the articles from, or make
+    up some if the data isn't there."""
+    if path.exists():
+        return [line["text"] for line in srsly.read_jsonl(path) if line.get("text")]
+    msg.warn(f"Can't find {path}, using synthetic texts")
+    rng = random.Random(0)
+    sentences = []
+    for _ in range(1000):
+        words = rng.choices(SYNTHETIC_WORDS, k=rng.randint(5, 30))
+        sentences.append(" ".join(words).capitalize() + ".")
+    return sentences
+
+
+def make_text(rng: random.Random, sentences: List[str], n_chars: int) -> str:
+    start = rng.randrange(len(sentences))
+    parts = []
+    length = 0
+    while length < n_chars:
+        parts.append(sentences[(start + len(parts)) % len(sentences)])
+        length += len(parts[-1]) + 1
+    return " ".join(parts)[:n_chars]
+
+
+def make_requests(
+    scenario: Scenario, sentences: List[str], rng: random.Random, n_requests: int
+) -> List[Tuple[str, List[str]]]:
+    """Create the model and texts of the requests up front, so generating them
+    doesn't count towards the latency."""
+    repeated = [
+        make_text(rng, sentences, rng.randint(scenario.min_chars, scenario.max_chars))
+        for _ in range(10)
+    ]
+    batch = []
+    for _ in range(n_requests):
+        texts = []
+        for _ in range(rng.randint(scenario.min_articles, scenario.max_articles)):
+            if rng.random() < scenario.duplicates:
+                texts.append(rng.choice(repeated))
+            else:
+                n_chars = rng.randint(scenario.min_chars, scenario.max_chars)
+                texts.append(make_text(rng, sentences, n_chars))
+        batch.append((rng.choice(scenario.models), texts))
+    return batch
+
+
+def send_request(
+    session: requests.Session,
+    base_url: str,
+    scenario: Scenario,
+    model: str,
+    texts: List[str],
+) -> int:
+    """Send one request and return its status. Streams report errors in the
+    last line of the response, so they're mapped to 500."""
+    headers = {"Accept": scenario.accept}
+    if scenario.stream:
+        params = {"model": model, "annotations": scenario.annotations}
+        body = "".join(srsly.json_dumps({"text": text}) + "\n" for text in texts)
+        response = session.post(
+            f"{base_url}/process/stream",
+            params=params,
+            data=body.encode("utf8"),
+            headers={**headers, "Content-Type": "application/x-ndjson"},
+        )
+        lines = response.text.splitlines()
+        if response.status_code == 200 and (
+            len(lines) != len(texts) or "error" in srsly.json_loads(lines[-1])
+        ):
+            return 500
+        return response.status_code
+    data = {
+        "articles": [{"text": text} for text in texts],
+        "model": model,
+        "annotations": scenario.annotations,
+        "chunking": scenario.chunking,
+    }
+    response = session.post(f"{base_url}/process/", json=data, headers=headers)
+    # Read the whole body, so the latency includes the transfer
+    response.content
+    return response.status_code
+
+
+def run_scenario(
+    base_url: str, scenario: Scenario, sentences: List[str], rng: random.Random
+) -> Dict[str, Any]:
+    """Send the requests of the scenario from `concurrency` threads, each of
+    which sends its next request as soon as its previous one has returned."""
+    warmup = make_requests(scenario, sentences, rng, scenario.warmup)
+    batch = make_requests(scenario, sentences, rng, scenario.requests)
+    result = ScenarioResult()
+    lock = threading.Lock()
+    local = threading.local()
+
+    def call(model: str, texts: List[str]) -> Tuple[float, int]:
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        start = timeit.default_timer()
+        try:
+            status = send_request(local.session, base_url, scenario, model, texts)
+        except Exception:
+            status = 0
+        return timeit.default_timer() - start, status
+
+    with ThreadPoolExecutor(max_workers=scenario.concurrency) as executor:
+        list(executor.map(lambda request: call(*request), warmup))
+        pending: Iterator[Tuple[str, List[str]]] = iter(batch)
+
+        def caller():
+            while True:
+                with lock:
+                    request = next(pending, None)
+                if request is None:
+                    return
+                seconds, status = call(*request)
+                n_chars = sum(len(text) for text in request[1])
+                with lock:
+                    result.add(seconds, status, len(request[1]), n_chars)
+
+        start = timeit.default_timer()
+        futures = [executor.submit(caller) for _ in range(scenario.concurrency)]
+        for future in futures:
+            future.result()
+        result.seconds = timeit.default_timer() - start
+    return result.to_dict()
+
+
+def get_server_stats(base_url: str) -> Dict[str, Any]:
+    """Snapshot of the batching and cache statistics of the server."""
+    stats = {}
+    for name in ("dispatcher", "cache", "admission"):
+        try:
+            response = requests.get(f"{base_url}/stats/{name}")
+            stats[name] = response.json() if response.status_code == 200 else None
+        except requests.RequestException:
+            stats[name] = None
+    return stats
+
+
+@contextmanager
+def serve(url: str) -> Iterator[str]:
+    """Yield the base URL of the server, starting one in this process if no
+    URL is given."""
+    if url:
+        yield url.rstrip("/")
+        return
+    import uvicorn
+    from .main import app
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    # Signals can only be handled in the main thread
+    server.install_signal_handlers = lambda: None
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            msg.fail("Couldn't start the server", exits=1)
+        time.sleep(0.1)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -1,10 +1,32 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
+import asyncio
+from collections import deque
 from enum import Enum
-from fastapi import FastAPI
+from functools import lru_cache, partial
+import os
+import time
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, ValidationError
+from starlette.concurrency import run_in_threadpool
+import psutil
 import spacy
 from spacy.tokens import Doc
+import srsly
+
+from .admission import AdmissionController
+from .annotations import Annotation, get_disabled_pipes, normalize_annotations
+from .chunking import merge_chunk_data, split_text
+from .cache import MB, ResponseCache, cache_key
+from .dispatcher import BatchDispatcher
+from .formats import DOCBIN, MSGPACK, docs_to_docbin, merge_docbins
+from .formats import negotiate_format
+from .metrics import HTTPMetrics, MetricsMiddleware, MetricsRegistry
+from .registry import ModelRegistry
+from .settings import Settings
+from .streaming import JSONStreamDecoder, NDJSONResponse
+from .workers import InferencePool
 
 
 class ModelName(str, Enum):
@@ -18,8 +40,16 @@ class ModelName(str, Enum):
 
 DEFAULT_MODEL = ModelName.en_core_web_sm
 MODEL_NAMES = [model.value for model in ModelName]
-MODELS = {name: spacy.load(name) for name in MODEL_NAMES}
-print(f"Loaded {len(MODEL_NAMES)} models: {MODEL_NAMES}")
+settings = Settings()
+# Models used when running inference in the server process. With worker
+# processes, each worker has its own registry, which starts out with the
+# preloaded models if there are any.
+REGISTRY = ModelRegistry(settings.max_models, settings.max_model_memory)
+# Server processes can be forked after importing the app, e.g. by gunicorn
+# --preload, and need their own process handle and locks
+os.register_at_fork(after_in_child=REGISTRY.after_fork)
+if settings.preload:
+    REGISTRY.preload([ModelName(name).value for name in settings.preload])
 
 
 class Article(BaseModel):
@@ -27,9 +57,16 @@ class Article(BaseModel):
     text: str
 
 
+DEFAULT_ANNOTATIONS = [Annotation.ents]
+
+
 class RequestModel(BaseModel):
     articles: List[Article]
     model: ModelName = DEFAULT_MODEL
+    # Only the components needed for these annotations are run
+    annotations: List[Annotation] = DEFAULT_ANNOTATIONS
+    # Split long articles into chunks that are processed in parallel
+    chunking: bool = False
 
 
 class ResponseModel(BaseModel):
@@ -42,46 +79,597 @@ class ResponseModel(BaseModel):
             start: int
             end: int
 
+        class Sentence(BaseModel):
+            start: int
+            end: int
+
+        class Token(BaseModel):
+            start: int
+            end: int
+            tag: Optional[str]
+            pos: Optional[str]
+            lemma: Optional[str]
+            dep: Optional[str]
+            head: Optional[int]
+            morph: Optional[str]
+
         text: str
-        ents: List[Entity] = []
+        ents: Optional[List[Entity]]
+        sents: Optional[List[Sentence]]
+        tokens: Optional[List[Token]]
 
     result: List[Batch]
 
 
-def get_data(doc: Doc) -> Dict[str, Any]:
-    """Extract the data to return from the REST API given a Doc object. Modify
-    this function to include other data."""
-    ents = [
-        {
-            "text": ent.text,
-            "label": ent.label_,
-            "start": ent.start_char,
-            "end": ent.end_char,
-        }
-        for ent in doc.ents
-    ]
-    return {"text": doc.text, "ents": ents}
+def get_data(doc: Doc, annotations: Tuple[Annotation, ...]) -> Dict[str, Any]:
+    """Extract the data to return from the REST API given a Doc object and the
+    requested annotations. Modify this function to include other data."""
+    data = {"text": doc.text}
+    if Annotation.ents in annotations:
+        data["ents"] = [
+            {
+                "text": ent.text,
+                "label": ent.label_,
+                "start": ent.start_char,
+                "end": ent.end_char,
+            }
+            for ent in doc.ents
+        ]
+    if Annotation.sents in annotations:
+        # Without a component setting sentence boundaries, there are no sents
+        sents = doc.sents if doc.has_annotation("SENT_START") else []
+        data["sents"] = [{"start": s.start_char, "end": s.end_char} for s in sents]
+    token_annotations = {
+        Annotation.tags: ("tag", lambda token: token.tag_),
+        Annotation.pos: ("pos", lambda token: token.pos_),
+        Annotation.lemmas: ("lemma", lambda token: token.lemma_),
+        Annotation.deps: ("dep", lambda token: token.dep_),
+        Annotation.morphs: ("morph", lambda token: str(token.morph)),
+    }
+    getters = [token_annotations[a] for a in annotations if a in token_annotations]
+    if getters:
+        data["tokens"] = []
+        for token in doc:
+            token_data = {"start": token.idx, "end": token.idx + len(token)}
+            for key, getter in getters:
+                token_data[key] = getter(token)
+            if Annotation.deps in annotations:
+                token_data["head"] = token.head.i
+            data["tokens"].append(token_data)
+    return data
+
 
+# Metrics exposed at /metrics in the Prometheus text format
+METRICS = MetricsRegistry()
+HTTP_METRICS = HTTPMetrics(METRICS)
+MODEL_LATENCY = METRICS.histogram(
+    "spacy_api_model_request_duration_seconds",
+    "Latency of the requests to /process/, per model",
+    labels=("model",),
+)
+DOCS = METRICS.counter(
+    "spacy_api_docs_total",
+    "Number of articles processed, including the ones taken from the cache",
+    labels=("model",),
+)
+CHARS = METRICS.counter(
+    "spacy_api_chars_total",
+    "Number of characters processed, including the ones taken from the cache",
+    labels=("model",),
+)
+MODEL_LOAD_SECONDS = METRICS.gauge(
+    "spacy_api_model_load_seconds",
+    "Time it took to load the resident models",
+    labels=("model", "pid"),
+)
+MODEL_MEMORY = METRICS.gauge(
+    "spacy_api_model_memory_bytes",
+    "Estimated memory of the resident models",
+    labels=("model", "pid"),
+)
+PROCESS_MEMORY = METRICS.gauge(
+    "spacy_api_process_resident_memory_bytes",
+    "Resident memory of the server and worker processes",
+    labels=("pid", "role"),
+)
+QUEUED_TEXTS = METRICS.gauge(
+    "spacy_api_dispatcher_queued_texts",
+    "Number of articles waiting to be batched",
+    labels=("model", "annotations"),
+)
+BATCHES = METRICS.counter(
+    "spacy_api_dispatcher_batches_total",
+    "Number of batches sent to the models",
+    labels=("model", "annotations"),
+)
+DOCS_IN_FLIGHT = METRICS.gauge(
+    "spacy_api_admission_docs_in_flight",
+    "Number of articles admitted and not yet processed",
+    labels=("model",),
+)
+CHARS_IN_FLIGHT = METRICS.gauge(
+    "spacy_api_admission_chars_in_flight",
+    "Number of characters admitted and not yet processed",
+    labels=("model",),
+)
+WAITING = METRICS.gauge(
+    "spacy_api_admission_waiting",
+    "Number of stream batches waiting for capacity",
+    labels=("model",),
+)
+REJECTED = METRICS.counter(
+    "spacy_api_rejected_requests_total",
+    "Number of requests rejected by the admission control, by status code",
+    labels=("model", "status"),
+)
+CACHE_LOOKUPS = METRICS.counter(
+    "spacy_api_cache_lookups_total",
+    "Number of cache lookups by result: memory_hit, disk_hit or miss",
+    labels=("result",),
+)
+CACHE_WRITE_ERRORS = METRICS.counter(
+    "spacy_api_cache_write_errors_total",
+    "Number of failed writes to the disk tier of the cache",
+)
 
 # Set up the FastAPI app and define the endpoints
 app = FastAPI()
 app.add_middleware(CORSMiddleware, allow_origins=["*"])
+app.add_middleware(
+    MetricsMiddleware,
+    metrics=HTTP_METRICS,
+    paths=lambda: [route.path for route in app.routes],
+)
+app.state.pool = None
+# One dispatcher per model and annotations, created on first use
+app.state.dispatchers = {}
+# One admission controller per model, created on first use
+app.state.admission = {}
+# Limit on the articles in flight for all models together
+app.state.total_admission = AdmissionController(settings.max_total_docs_in_flight)
+app.state.cache = None
+
+
+@app.on_event("startup")
+async def start_workers():
+    if settings.workers:
+        pool = InferencePool(
+            get_data,
+            settings.workers,
+            max_models=settings.max_models,
+            max_memory_mb=settings.max_model_memory,
+            registry=REGISTRY if settings.preload else None,
+        )
+        await pool.start()
+        app.state.pool = pool
+        print(f"Started {settings.workers} workers")
+
+
+@app.on_event("startup")
+def open_cache():
+    # Opened on startup rather than when the app is imported, so every server
+    # process has its own database connection, even if the processes are forked
+    # after importing the app, e.g. by gunicorn --preload. It's opened after
+    # starting the workers, so they don't inherit the connection either.
+    if settings.cache_memory:
+        app.state.cache = ResponseCache(
+            settings.cache_memory * MB, settings.cache_path, settings.cache_disk * MB
+        )
+
+
+@app.on_event("shutdown")
+def stop_workers():
+    for dispatcher in app.state.dispatchers.values():
+        dispatcher.close()
+    if app.state.pool is not None:
+        app.state.pool.shutdown()
+
+
+def process_in_server(
+    model_name: str, annotations: Tuple[Annotation, ...], texts: List[str]
+) -> List[Dict[str, Any]]:
+    nlp = REGISTRY.get(model_name)
+    disable = get_disabled_pipes(model_name, nlp, annotations)
+    return [get_data(doc, annotations) for doc in nlp.pipe(texts, disable=disable)]
+
+
+def docbin_in_server(
+    model_name: str, annotations: Tuple[Annotation, ...], texts: List[str]
+) -> bytes:
+    nlp = REGISTRY.get(model_name)
+    disable = get_disabled_pipes(model_name, nlp, annotations)
+    return docs_to_docbin(nlp.pipe(texts, disable=disable), annotations)
+
+
+def get_dispatcher(
+    model_name: str, annotations: Tuple[Annotation, ...]
+) -> BatchDispatcher:
+    # Requests can only be batched if they run the same components
+    key = (model_name, annotations)
+    if key not in app.state.dispatchers:
+        pool = app.state.pool
+        if pool is not None:
+            process_batch = partial(pool.process, model_name, annotations)
+            max_in_flight = pool.n_workers
+        else:
+            # Run the model in a thread so it doesn't block the event loop
+            process_batch = partial(
+                run_in_threadpool, process_in_server, model_name, annotations
+            )
+            max_in_flight = 1
+        app.state.dispatchers[key] = BatchDispatcher(
+            process_batch,
+            max_batch_size=settings.max_batch_size,
+            max_wait=settings.max_batch_wait_ms / 1000,
+            max_in_flight=max_in_flight,
+            max_batch_chars=settings.max_batch_chars,
+        )
+    return app.state.dispatchers[key]
+
+
+def get_admission(model_name: str) -> AdmissionController:
+    if model_name not in app.state.admission:
+        app.state.admission[model_name] = AdmissionController(
+            settings.max_docs_in_flight, settings.max_chars_in_flight
+        )
+    return app.state.admission[model_name]
+
+
+def admit(model_name: str, texts: List[str]) -> Tuple[int, int]:
+    """Admit the texts for processing or raise an HTTPException if the limits
+    are exceeded, and return the number of articles and characters admitted.
+    The caller has to release them once they're processed."""
+    docs = len(texts)
+    chars = sum(len(text) for text in texts)
+    admission = get_admission(model_name)
+    total_admission = app.state.total_admission
+    if admission.too_large(docs, chars) or total_admission.too_large(docs, chars):
+        REJECTED.inc(model=model_name, status=413)
+        raise HTTPException(
+            413,
+            detail="The request exceeds the limits on the articles or characters "
+            "in flight. Split it up or use /process/stream instead.",
+        )
+    if not total_admission.try_acquire(docs, chars):
+        admission.n_rejected += 1
+        REJECTED.inc(model=model_name, status=503)
+        raise HTTPException(
+            503,
+            detail="The service is overloaded, try again later.",
+            headers={"Retry-After": str(total_admission.retry_after())},
+        )
+    if not admission.try_acquire(docs, chars):
+        total_admission.cancel(docs, chars)
+        REJECTED.inc(model=model_name, status=429)
+        raise HTTPException(
+            429,
+            detail=f"Too much work in flight for {model_name}, try again later.",
+            headers={"Retry-After": str(admission.retry_after())},
+        )
+    return docs, chars
+
+
+def release_admitted(model_name: str, docs: int, chars: int) -> None:
+    """Release the articles and characters admitted for processing."""
+    get_admission(model_name).release(docs, chars)
+    app.state.total_admission.release(docs, chars)
+
+
+async def process_admitted(
+    model_name: str, annotations: Tuple[Annotation, ...], texts: List[str]
+) -> List[Dict[str, Any]]:
+    """Wait until the texts can be admitted and process them."""
+    docs = len(texts)
+    chars = sum(len(text) for text in texts)
+    admission = get_admission(model_name)
+    await admission.acquire(docs, chars)
+    try:
+        await app.state.total_admission.acquire(docs, chars)
+    except BaseException:
+        admission.cancel(docs, chars)
+        raise
+    try:
+        return await process_texts(model_name, annotations, texts)
+    finally:
+        release_admitted(model_name, docs, chars)
+
+
+@lru_cache()
+def get_model_version(model_name: str) -> str:
+    # Read from the package metadata, so the model doesn't have to be loaded
+    return spacy.util.get_package_version(model_name) or ""
 
 
-@app.get("/models", summary="List all loaded models")
+async def process_texts(
+    model_name: str, annotations: Tuple[Annotation, ...], texts: List[str]
+) -> List[Dict[str, Any]]:
+    """Process the texts with the given model, taking the data of previously
+    processed texts from the cache if enabled."""
+    DOCS.inc(len(texts), model=model_name)
+    CHARS.inc(sum(len(text) for text in texts), model=model_name)
+    dispatcher = get_dispatcher(model_name, annotations)
+    cache = app.state.cache
+    if cache is None:
+        return await dispatcher.process(texts)
+    version = get_model_version(model_name)
+    variant = ",".join(annotations)
+    keys = [cache_key(model_name, version, variant, text) for text in texts]
+    results = await cache.get_many(keys)
+    # Only process each uncached text once, even if it's repeated in the batch
+    missing = {
+        key: text for key, text, data in zip(keys, texts, results) if data is None
+    }
+    if missing:
+        data = await dispatcher.process(list(missing.values()))
+        processed = dict(zip(missing.keys(), data))
+        results = [processed.get(key, cached) for key, cached in zip(keys, results)]
+        await cache.set_many(list(processed.items()))
+    return results
+
+
+async def process_texts_in_chunks(
+    model_name: str, annotations: Tuple[Annotation, ...], texts: List[str]
+) -> List[Dict[str, Any]]:
+    """Process the texts like process_texts, but split long texts into chunks
+    that can be processed in parallel, and merge the data of the chunks."""
+    chunked = [split_text(text, settings.chunk_chars) for text in texts]
+    chunk_texts = [chunk for chunks in chunked for _, chunk in chunks]
+    chunk_data = iter(await process_texts(model_name, annotations, chunk_texts))
+    return [
+        merge_chunk_data(text, [(offset, next(chunk_data)) for offset, _ in chunks])
+        for text, chunks in zip(texts, chunked)
+    ]
+
+
+async def process_texts_to_docbin(
+    model_name: str, annotations: Tuple[Annotation, ...], texts: List[str]
+) -> bytes:
+    """Process the texts with the given model and return the docs as a
+    serialized DocBin. This skips get_data and the cache, and the DocBins are
+    built by the workers."""
+    DOCS.inc(len(texts), model=model_name)
+    CHARS.inc(sum(len(text) for text in texts), model=model_name)
+    pool = app.state.pool
+    if pool is None:
+        return await run_in_threadpool(docbin_in_server, model_name, annotations, texts)
+    # Split the texts over the workers like the dispatcher does
+    size = settings.max_batch_size
+    batches = [texts[i : i + size] for i in range(0, len(texts), size)] or [texts]
+    docbins = await asyncio.gather(
+        *(pool.process_docbin(model_name, annotations, batch) for batch in batches)
+    )
+    return await run_in_threadpool(merge_docbins, docbins)
+
+
+@app.get("/models", summary="List all available models")
 def get_models() -> List[str]:
-    """Return a list of all available loaded models."""
+    """Return a list of all available models. Models are loaded on first use."""
     return MODEL_NAMES
 
 
-@app.post("/process/", summary="Process batches of text", response_model=ResponseModel)
-def process_articles(query: RequestModel):
-    """Process a batch of articles and return the entities predicted by the
-    given model. Each record in the data should have a key "text".
+@app.get("/models/resident", summary="List the models currently loaded")
+def get_resident_models() -> List[Dict[str, Any]]:
+    """Return the models loaded by each process running inference, least
+    recently used first, with their load times and estimated memory. Worker
+    processes report their models with each result, so a worker only shows up
+    once it has processed a request.
+    """
+    if app.state.pool is not None:
+        workers = app.state.pool.worker_models.items()
+        return [{"pid": pid, "models": models} for pid, models in workers]
+    return [{"pid": os.getpid(), "models": REGISTRY.status()}]
+
+
+@app.post(
+    "/process/",
+    summary="Process batches of text",
+    response_model=ResponseModel,
+    # Leave out the annotations that weren't requested
+    response_model_exclude_none=True,
+    responses={200: {"content": {MSGPACK: {}, DOCBIN: {}}}},
+)
+async def process_articles(query: RequestModel, accept: Optional[str] = Header(None)):
+    """Process a batch of articles and return the annotations predicted by the
+    given model, by default the entities. Each record in the data should have a
+    key "text". With "chunking", long articles are split into paragraph- or
+    sentence-aligned chunks that are processed in parallel, and the character
+    offsets are merged back relative to the original text.
+
+    The response format is chosen via the Accept header. By default, the
+    results are returned as validated JSON. With application/msgpack, the
+    data returned by get_data is sent as msgpack without validation. With
+    application/x-spacy-docbin, the processed docs are sent as a serialized
+    DocBin with the attributes of the requested annotations.
+    """
+    start = time.perf_counter()
+    model_name = query.model.value
+    texts = [article.text for article in query.articles]
+    annotations = normalize_annotations(query.annotations)
+    response_format = negotiate_format(accept)
+    if query.chunking and response_format == DOCBIN:
+        raise HTTPException(400, detail="Chunking isn't supported for DocBins.")
+    docs, chars = admit(model_name, texts)
+    try:
+        if response_format == DOCBIN:
+            content = await process_texts_to_docbin(model_name, annotations, texts)
+            response = Response(content, media_type=DOCBIN)
+        else:
+            if query.chunking:
+                process = process_texts_in_chunks
+            else:
+                process = process_texts
+            response_body = await process(model_name, annotations, texts)
+            if response_format == MSGPACK:
+                # Returning a response directly skips the validation of the data
+                content = srsly.msgpack_dumps({"result": response_body})
+                response = Response(content, media_type=MSGPACK)
+            else:
+                response = {"result": response_body}
+    finally:
+        release_admitted(model_name, docs, chars)
+    MODEL_LATENCY.observe(time.perf_counter() - start, model=model_name)
+    return response
+
+
+async def stream_results(
+    request: Request, model_name: str, annotations: Tuple[Annotation, ...]
+) -> AsyncIterator[str]:
+    # Articles are processed in batches while the request is read, with a
+    # bounded number of batches in flight, and the results are written in order
+    # as soon as they're done. This way the memory needed doesn't depend on the
+    # number of articles. If the model is at its limits, the batches wait for
+    # capacity, which slows down reading the request.
+    max_in_flight = 2 * max(settings.workers, 1)
+    in_flight = deque()
+    batch = []
+    decoder = JSONStreamDecoder()
+    error = None
+    try:
+        async for chunk in request.stream():
+            for value in decoder.feed(chunk):
+                batch.append(Article.parse_obj(value).text)
+                if len(batch) >= settings.max_batch_size:
+                    future = asyncio.ensure_future(
+                        process_admitted(model_name, annotations, batch)
+                    )
+                    in_flight.append(future)
+                    batch = []
+                while len(in_flight) >= max_in_flight:
+                    for data in await in_flight.popleft():
+                        yield srsly.json_dumps(data) + "\n"
+        decoder.close()
+    except (ValueError, ValidationError) as e:
+        # The response has already started, so we can't change the status
+        # anymore. Report the error after the results of the articles before it.
+        error = f"Invalid input: {e}"
+    in_flight.append(
+        asyncio.ensure_future(process_admitted(model_name, annotations, batch))
+    )
+    while in_flight:
+        for data in await in_flight.popleft():
+            yield srsly.json_dumps(data) + "\n"
+    if error is not None:
+        yield srsly.json_dumps({"error": error}) + "\n"
+
+
+@app.post("/process/stream", summary="Process a stream of articles")
+async def process_article_stream(
+    request: Request,
+    model: ModelName = DEFAULT_MODEL,
+    annotations: List[Annotation] = Query(DEFAULT_ANNOTATIONS),
+):
+    """Process a stream of articles sent as NDJSON, or as a JSON array, and
+    return the results as NDJSON with one line per article, in order. Results
+    are sent back while the articles are still being received. Each article
+    should be an object with a key "text". If the input turns out to be
+    invalid, the last line is an object with the key "error".
     """
-    nlp = MODELS[query.model]
-    response_body = []
-    texts = (article.text for article in query.articles)
-    for doc in nlp.pipe(texts):
-        response_body.append(get_data(doc))
-    return {"result": response_body}
+    annotations = normalize_annotations(annotations)
+    return NDJSONResponse(stream_results(request, model.value, annotations))
+
+
+@app.get("/stats/dispatcher", summary="Show the batching statistics")
+def get_dispatcher_stats() -> List[Dict[str, Any]]:
+    """Return the queue depth, batch size histogram and queue waits of the
+    recent requests for each model and combination of annotations that has
+    been used."""
+    return [
+        {"model": model_name, "annotations": annotations, **dispatcher.status()}
+        for (model_name, annotations), dispatcher in app.state.dispatchers.items()
+    ]
+
+
+@app.get("/stats/admission", summary="Show the work in flight")
+def get_admission_stats() -> Dict[str, Dict[str, Any]]:
+    """Return the articles and characters in flight for each model, with the
+    limits and the number of admitted and rejected requests."""
+    return {name: admission.status() for name, admission in app.state.admission.items()}
+
+
+@app.get("/stats/cache", summary="Show the cache statistics")
+def get_cache_stats() -> Dict[str, Any]:
+    """Return the hit rates and sizes of the response cache, if enabled."""
+    if app.state.cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **app.state.cache.status()}
+
+
+def get_process_memory(process: psutil.Process, role: str) -> Dict[str, Any]:
+    info = process.memory_full_info()
+    memory = {"pid": process.pid, "role": role, "rss_mb": info.rss / MB}
+    # The unique and proportional set sizes aren't available on all platforms
+    if hasattr(info, "uss"):
+        memory["uss_mb"] = info.uss / MB
+        memory["shared_mb"] = (info.rss - info.uss) / MB
+    if hasattr(info, "pss"):
+        memory["pss_mb"] = info.pss / MB
+    return {
+        key: round(value, 1) if key.endswith("_mb") else value
+        for key, value in memory.items()
+    }
+
+
+@app.get("/stats/memory", summary="Show the memory shared between processes")
+def get_memory_stats() -> Dict[str, Any]:
+    """Return the memory of the server and worker processes: the resident set
+    size (RSS), the part of it only used by the process (USS) or shared with
+    other processes, and the proportional set size (PSS), which splits the
+    shared memory evenly between the processes sharing it. The difference
+    between the total RSS and the total PSS is the memory saved by sharing,
+    e.g. of preloaded models shared with the workers. Computing these takes a
+    while for large processes, so they aren't part of the metrics.
+    """
+    server = psutil.Process()
+    processes = [get_process_memory(server, "server")]
+    for worker in server.children():
+        try:
+            processes.append(get_process_memory(worker, "worker"))
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+    stats: Dict[str, Any] = {"processes": processes}
+    stats["rss_mb"] = round(sum(process["rss_mb"] for process in processes), 1)
+    if all("pss_mb" in process for process in processes):
+        stats["pss_mb"] = round(sum(process["pss_mb"] for process in processes), 1)
+        stats["saved_mb"] = round(stats["rss_mb"] - stats["pss_mb"], 1)
+    return stats
+
+
+@METRICS.collector
+def collect_metrics():
+    MODEL_LOAD_SECONDS.clear()
+    MODEL_MEMORY.clear()
+    for process in get_resident_models():
+        for model in process["models"]:
+            labels = {"model": model["name"], "pid": process["pid"]}
+            MODEL_LOAD_SECONDS.set(model["load_seconds"], **labels)
+            MODEL_MEMORY.set(model["memory_mb"] * MB, **labels)
+    PROCESS_MEMORY.clear()
+    server = psutil.Process()
+    PROCESS_MEMORY.set(server.memory_info().rss, pid=server.pid, role="server")
+    for worker in server.children():
+        try:
+            PROCESS_MEMORY.set(worker.memory_info().rss, pid=worker.pid, role="worker")
+        except psutil.NoSuchProcess:
+            pass
+    for (model_name, annotations), dispatcher in app.state.dispatchers.items():
+        labels = {"model": model_name, "annotations": ",".join(annotations)}
+        QUEUED_TEXTS.set(dispatcher.status()["queued_texts"], **labels)
+        BATCHES.set(dispatcher.n_batches, **labels)
+    for model_name, admission in app.state.admission.items():
+        DOCS_IN_FLIGHT.set(admission.docs, model=model_name)
+        CHARS_IN_FLIGHT.set(admission.chars, model=model_name)
+        WAITING.set(admission.n_waiting, model=model_name)
+    cache = app.state.cache
+    if cache is not None:
+        CACHE_LOOKUPS.set(cache.memory_hits, result="memory_hit")
+        CACHE_LOOKUPS.set(cache.disk_hits, result="disk_hit")
+        CACHE_LOOKUPS.set(cache.misses, result="miss")
+        CACHE_WRITE_ERRORS.set(cache.write_errors)
+
+
+@app.get("/metrics", summary="Show the metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Return the metrics of the service in the Prometheus text format."""
+    # Rendered in the event loop, so the metrics don't change while rendering
+    content = METRICS.render()
+    return PlainTextResponse(content, media_type="text/plain; version=0.0.4")
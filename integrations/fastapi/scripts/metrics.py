@@ -0,0 +1,229 @@
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Default upper bounds of the latency histograms, in seconds
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (
+        str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        for value in values
+    )
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, escaped))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    """Base class of the metrics, holding one value per combination of label
+    values."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = tuple()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def set(self, value: float, **labels: str) -> None:
+        """Set the value, e.g. from statistics that are tracked elsewhere."""
+        self._values[self._key(labels)] = value
+
+    def clear(self) -> None:
+        self._values.clear()
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        for key, value in self._values.items():
+            yield self.name, _format_labels(self.label_names, key), value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {value}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = tuple(),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = list(buckets)
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        if key not in self._counts:
+            self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0.0
+        counts = self._counts[key]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+        self._sums[key] += value
+
+    def clear(self) -> None:
+        self._counts.clear()
+        self._sums.clear()
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        bucket_names = self.label_names + ("le",)
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        for key, counts in self._counts.items():
+            total = 0
+            for bound, count in zip(bounds, counts):
+                total += count
+                labels = _format_labels(bucket_names, key + (bound,))
+                yield f"{self.name}_bucket", labels, total
+            labels = _format_labels(self.label_names, key)
+            yield f"{self.name}_sum", labels, self._sums[key]
+            yield f"{self.name}_count", labels, total
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered in the Prometheus text format. Collectors
+    are called before rendering, to update metrics that are computed on
+    demand, like the memory usage."""
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        self.collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = tuple()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = tuple()) -> Gauge:
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = tuple(),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collector(self, func: Callable[[], None]) -> Callable[[], None]:
+        """Register a function to call before rendering. Can be used as a
+        decorator."""
+        self.collectors.append(func)
+        return func
+
+    def render(self) -> str:
+        for collect in self.collectors:
+            collect()
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class HTTPMetrics:
+    """Number, latency and status of the HTTP requests per path, and the
+    requests in flight."""
+
+    def __init__(self, registry: MetricsRegistry):
+        self.requests = registry.counter(
+            "spacy_api_http_requests_total",
+            "Number of HTTP requests",
+            labels=("path", "method", "status"),
+        )
+        self.latency = registry.histogram(
+            "spacy_api_http_request_duration_seconds",
+            "Latency of the HTTP requests, until the response is complete",
+            labels=("path",),
+        )
+        self.in_flight = registry.gauge(
+            "spacy_api_http_requests_in_flight",
+            "Number of HTTP requests being processed",
+            labels=("path",),
+        )
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording the HTTP metrics. Paths that don't belong to
+    a route are recorded as "other", so unknown URLs can't blow up the number
+    of label values. It's implemented as plain ASGI middleware, so it doesn't
+    get in the way of streaming responses and adds very little overhead.
+
+    paths (Callable[[], Iterable[str]]): Return the paths of the routes. Called
+        on the first request, once all routes have been added.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        metrics: HTTPMetrics,
+        paths: Callable[[], Iterable[str]],
+    ):
+        self.app = app
+        self.metrics = metrics
+        self.get_paths = paths
+        self._paths: Optional[Set[str]] = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if self._paths is None:
+            self._paths = set(self.get_paths())
+        path = scope["path"] if scope["path"] in self._paths else "other"
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self.metrics.in_flight.inc(path=path)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.metrics.latency.observe(time.perf_counter() - start, path=path)
+            self.metrics.in_flight.dec(path=path)
+            self.metrics.requests.inc(path=path, method=scope["method"], status=status)
@@ -0,0 +1,148 @@
+import gc
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List
+import psutil
+import spacy
+from spacy.language import Language
+
+MB = 1024 * 1024
+
+
+@dataclass
+class ResidentModel:
+    nlp: Language
+    load_seconds: float
+    memory_mb: float
+    loaded_at: float
+    last_used: float
+    uses: int = 0
+    preloaded: bool = False
+
+
+class ModelRegistry:
+    """Models of the current process, loaded on first use. If more models are
+    loaded than allowed by the count or memory budget, the least recently used
+    ones are evicted. A budget of 0 means no limit.
+
+    The memory of a model is estimated from the growth of the resident set
+    size while it's loaded, so it includes everything the model allocated.
+
+    Models can also be preloaded, e.g. before worker processes are forked, so
+    the workers share their memory copy-on-write. Preloaded models are never
+    evicted and don't count towards the budget.
+    """
+
+    def __init__(self, max_models: int = 0, max_memory_mb: int = 0):
+        self.max_models = max_models
+        self.max_memory_mb = max_memory_mb
+        self._models: "OrderedDict[str, ResidentModel]" = OrderedDict()
+        # Guards the dict of resident models, only held briefly
+        self._lock = threading.Lock()
+        # Held while a model is loaded, so loads happen one at a time and the
+        # memory measurement isn't skewed by other loads
+        self._load_lock = threading.Lock()
+        self._process = psutil.Process()
+
+    def get(self, name: str) -> Language:
+        """Return the model with the given name, loading it if necessary."""
+        nlp = self._get_resident(name)
+        if nlp is not None:
+            return nlp
+        with self._load_lock:
+            # Another thread may have loaded the model while we were waiting
+            nlp = self._get_resident(name)
+            if nlp is not None:
+                return nlp
+            return self._load(name)
+
+    def preload(self, names: List[str]) -> None:
+        """Load the models up front. Afterwards, all objects tracked by the
+        garbage collector are moved to the permanent generation, so the
+        collector doesn't write to them in processes forked from this one,
+        which would copy the memory pages they're on."""
+        with self._load_lock:
+            for name in names:
+                if self._get_resident(name) is None:
+                    self._load(name, preloaded=True)
+        gc.freeze()
+
+    def _load(self, name: str, preloaded: bool = False) -> Language:
+        rss = self._process.memory_info().rss
+        start = time.perf_counter()
+        nlp = spacy.load(name)
+        load_seconds = time.perf_counter() - start
+        memory_mb = max(self._process.memory_info().rss - rss, 0) / MB
+        now = time.time()
+        with self._lock:
+            self._models[name] = ResidentModel(
+                nlp,
+                load_seconds,
+                memory_mb,
+                loaded_at=now,
+                last_used=now,
+                uses=0 if preloaded else 1,
+                preloaded=preloaded,
+            )
+            evicted = self._evict()
+        if evicted:
+            # Language objects have reference cycles, so make sure the
+            # memory of the evicted models is released right away
+            gc.collect()
+        print(f"Loaded model {name} in {load_seconds:.2f}s ({memory_mb:.0f} MB)")
+        return nlp
+
+    def after_fork(self) -> None:
+        """Reset the state that belongs to the parent process, to be called in
+        a process forked from the one that loaded the models."""
+        self._process = psutil.Process()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def _get_resident(self, name: str):
+        with self._lock:
+            model = self._models.get(name)
+            if model is None:
+                return None
+            self._models.move_to_end(name)
+            model.last_used = time.time()
+            model.uses += 1
+            return model.nlp
+
+    def _evict(self) -> List[str]:
+        # Never evict the most recently used model, even if it's over budget
+        # on its own, or the preloaded ones
+        evicted = []
+        while True:
+            candidates = [
+                name for name, model in self._models.items() if not model.preloaded
+            ]
+            if len(candidates) <= 1 or not self._over_budget(candidates):
+                return evicted
+            del self._models[candidates[0]]
+            evicted.append(candidates[0])
+            print(f"Evicted model {candidates[0]}")
+
+    def _over_budget(self, names: List[str]) -> bool:
+        if self.max_models and len(names) > self.max_models:
+            return True
+        memory_mb = sum(self._models[name].memory_mb for name in names)
+        return bool(self.max_memory_mb) and memory_mb > self.max_memory_mb
+
+    def status(self) -> List[Dict[str, Any]]:
+        """Return the resident models, least recently used first."""
+        with self._lock:
+            return [
+                {
+                    "name": name,
+                    "load_seconds": round(model.load_seconds, 3),
+                    "memory_mb": round(model.memory_mb, 1),
+                    "loaded_at": model.loaded_at,
+                    "last_used": model.last_used,
+                    "uses": model.uses,
+                    "preloaded": model.preloaded,
+                }
+                for name, model in self._models.items()
+            ]
@@ -0,0 +1,55 @@
+from pathlib import Path
+from typing import List, Optional
+from pydantic import BaseSettings
+
+
+class Settings(BaseSettings):
+    # Configuration of the service. Every setting can be overridden with an
+    # environment variable prefixed with SPACY_API_, e.g. SPACY_API_WORKERS=4.
+
+    # Number of worker processes running the models. By default, inference runs
+    # in the server process itself. Each worker loads its own copy of the
+    # models it uses, so only use workers with a single server process, e.g.
+    # not with one server process per core as in the Docker image.
+    workers: int = 0
+    # The articles of concurrent requests for the same model are processed
+    # together in batches of up to max_batch_size articles and max_batch_chars
+    # characters. A batch is sent off once it's full or its oldest request has
+    # waited max_batch_wait_ms. Larger requests are split, so they're spread
+    # over the workers.
+    max_batch_size: int = 64
+    max_batch_chars: int = 50_000
+    max_batch_wait_ms: float = 5
+    # Cache the data returned for each text, keyed by the model name, model
+    # version and text. cache_memory is the size of the in-memory tier in MB,
+    # 0 disables the cache. If cache_path is set, entries are also stored in an
+    # SQLite database of up to cache_disk MB.
+    cache_memory: int = 0
+    cache_path: Optional[Path] = None
+    cache_disk: int = 1024
+    # Requests can ask for long articles to be split into chunks of up to
+    # chunk_chars characters, aligned with paragraphs or sentences, that are
+    # processed in parallel
+    chunk_chars: int = 5_000
+    # Limits on the articles and characters in flight per model. Requests over
+    # the limits are rejected with 429 Too Many Requests, requests that exceed
+    # them on their own with 413. If the articles in flight for all models
+    # together exceed max_total_docs_in_flight, requests are rejected with 503
+    # Service Unavailable. Streams wait for capacity instead. 0 means no limit.
+    max_docs_in_flight: int = 0
+    max_chars_in_flight: int = 0
+    max_total_docs_in_flight: int = 0
+    # Models are loaded on first use. If a process has more models loaded than
+    # allowed by these budgets, the least recently used ones are evicted. The
+    # memory budget is in MB per process. 0 means no limit.
+    max_models: int = 0
+    max_model_memory: int = 0
+    # Models to load when the app is imported, as a JSON list, e.g.
+    # SPACY_API_PRELOAD='["en_core_web_sm"]'. The worker processes are then
+    # forked from the server process and share the memory of these models
+    # copy-on-write. The same goes for server processes forked after the app is
+    # imported, e.g. by gunicorn --preload.
+    preload: List[str] = []
+
+    class Config:
+        env_prefix = "SPACY_API_"
@@ -0,0 +1,86 @@
+import codecs
+import json
+from typing import Any, List
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+# Maximum size in characters of a single value in the stream. Without a limit,
+# a malformed value would make the decoder buffer the rest of the stream.
+MAX_VALUE_SIZE = 10_000_000
+WHITESPACE = " \t\n\r"
+
+
+class JSONStreamDecoder:
+    """Incrementally decode a stream of JSON values that are either newline
+    delimited (NDJSON) or the elements of one top-level array. Feed it chunks
+    of bytes as they arrive and it returns the values completed so far, so
+    only the value currently being received has to be held in memory.
+    """
+
+    def __init__(self):
+        self._bytes_decoder = codecs.getincrementaldecoder("utf8")()
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        # Whether the stream is an array, known once we've seen the first value
+        self._in_array = None
+        self._array_closed = False
+
+    def feed(self, chunk: bytes) -> List[Any]:
+        """Decode the next chunk of the stream and return the values it
+        completed."""
+        buffer = self._buffer + self._bytes_decoder.decode(chunk)
+        values = []
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in WHITESPACE:
+                pos += 1
+            if pos == len(buffer):
+                break
+            if self._array_closed:
+                raise ValueError("Unexpected data after the end of the array")
+            if self._in_array is None:
+                self._in_array = buffer[pos] == "["
+                if self._in_array:
+                    pos += 1
+                    continue
+            if self._in_array and buffer[pos] in ",]":
+                self._array_closed = buffer[pos] == "]"
+                pos += 1
+                continue
+            try:
+                value, pos = self._decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Most likely the value isn't complete yet. A line of NDJSON
+                # is complete once there's a newline after it, though.
+                if not self._in_array and "\n" in buffer[pos:]:
+                    raise
+                break
+            values.append(value)
+        self._buffer = buffer[pos:]
+        if len(self._buffer) > MAX_VALUE_SIZE:
+            raise ValueError(f"Value exceeds the maximum size of {MAX_VALUE_SIZE}")
+        return values
+
+    def close(self) -> None:
+        """Check that the stream didn't end in the middle of a value."""
+        rest = self._buffer + self._bytes_decoder.decode(b"", final=True)
+        if rest.strip(WHITESPACE):
+            # Get the error message for the invalid or incomplete value
+            self._decoder.decode(rest)
+        if self._in_array and not self._array_closed:
+            raise ValueError("Unexpected end of the stream inside an array")
+
+
+class NDJSONResponse(StreamingResponse):
+    """Streaming response with one JSON value per line. Unlike the regular
+    StreamingResponse, it doesn't listen for the client disconnecting while
+    streaming, because that would consume the request body. This lets the
+    response be generated while the request body is still being read.
+    """
+
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,148 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from spacy.tokens import Doc
+
+from .annotations import Annotation, get_disabled_pipes
+from .formats import docs_to_docbin
+from .registry import ModelRegistry
+
+GetData = Callable[[Doc, Tuple[Annotation, ...]], Dict[str, Any]]
+# Models and get_data function of the current worker process, set up by the
+# initializer when the worker starts
+_REGISTRY: ModelRegistry
+_GET_DATA: GetData
+
+
+def _init_worker(
+    max_models: int,
+    max_memory_mb: int,
+    get_data: GetData,
+    registry: Optional[ModelRegistry] = None,
+):
+    global _REGISTRY, _GET_DATA
+    if registry is not None:
+        # Inherited from the server process when the worker was forked
+        registry.after_fork()
+        _REGISTRY = registry
+    else:
+        _REGISTRY = ModelRegistry(max_models, max_memory_mb)
+    _GET_DATA = get_data
+
+
+def _ping() -> bool:
+    return True
+
+
+def _pipe(
+    model_name: str, annotations: Tuple[Annotation, ...], texts: List[str]
+) -> Iterable[Doc]:
+    nlp = _REGISTRY.get(model_name)
+    disable = get_disabled_pipes(model_name, nlp, annotations)
+    return nlp.pipe(texts, disable=disable)
+
+
+def _process(
+    model_name: str, annotations: Tuple[Annotation, ...], texts: List[str]
+) -> Tuple[List[Dict[str, Any]], int, List[Dict[str, Any]]]:
+    docs = _pipe(model_name, annotations, texts)
+    data = [_GET_DATA(doc, annotations) for doc in docs]
+    # Send the models resident in this worker along with the results, so the
+    # server can report them without having to ask the workers
+    return data, os.getpid(), _REGISTRY.status()
+
+
+def _process_docbin(
+    model_name: str, annotations: Tuple[Annotation, ...], texts: List[str]
+) -> Tuple[bytes, int, List[Dict[str, Any]]]:
+    docs = _pipe(model_name, annotations, texts)
+    return docs_to_docbin(docs, annotations), os.getpid(), _REGISTRY.status()
+
+
+class InferencePool:
+    """Pool of worker processes that load the models on first use. Each batch
+    of texts is processed by one of the workers, so the server can use all
+    cores and the event loop is never blocked by a model.
+
+    registry (Optional[ModelRegistry]): Models preloaded by the server process
+        to share with the workers. The workers are forked, so they inherit the
+        models and share their memory copy-on-write instead of loading their
+        own copies. The budgets of the registry apply to the models the
+        workers load on demand.
+    """
+
+    def __init__(
+        self,
+        get_data: GetData,
+        n_workers: int,
+        max_models: int = 0,
+        max_memory_mb: int = 0,
+        registry: Optional[ModelRegistry] = None,
+    ):
+        self.n_workers = n_workers
+        mp_context = None
+        if registry is not None:
+            if "fork" not in multiprocessing.get_all_start_methods():
+                raise ValueError("Sharing models with the workers requires fork")
+            # With fork, all workers are started on the first task, before the
+            # executor starts its thread, and the initargs aren't pickled
+            mp_context = multiprocessing.get_context("fork")
+        self._executor_args = dict(
+            max_workers=n_workers,
+            mp_context=mp_context,
+            initializer=_init_worker,
+            initargs=(max_models, max_memory_mb, get_data, registry),
+        )
+        self.executor = ProcessPoolExecutor(**self._executor_args)
+        # Resident models of each worker process as of its last task
+        self.worker_models: Dict[int, List[Dict[str, Any]]] = {}
+
+    async def start(self) -> None:
+        """Start the worker processes and wait until they're ready."""
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self.executor, _ping)
+
+    async def process(
+        self, model_name: str, annotations: Tuple[Annotation, ...], texts: List[str]
+    ) -> List[Dict[str, Any]]:
+        """Process a batch of texts with the components of the given model
+        needed for the annotations and return the data for each text, in
+        order."""
+        return await self._run(_process, model_name, annotations, texts)
+
+    async def process_docbin(
+        self, model_name: str, annotations: Tuple[Annotation, ...], texts: List[str]
+    ) -> bytes:
+        """Process a batch of texts like process, but return the docs as a
+        serialized DocBin with the attributes of the annotations."""
+        return await self._run(_process_docbin, model_name, annotations, texts)
+
+    async def _run(self, func: Callable, *args) -> Any:
+        loop = asyncio.get_event_loop()
+        executor = self.executor
+        try:
+            data, pid, models = await loop.run_in_executor(executor, func, *args)
+        except BrokenProcessPool:
+            # A worker died, e.g. killed for running out of memory, which
+            # leaves the executor unusable. Only the batches in flight fail:
+            # the first of them to get here replaces the executor for the
+            # requests that follow.
+            if self.executor is executor:
+                await self._restart()
+            raise
+        self.worker_models[pid] = models
+        return data
+
+    async def _restart(self) -> None:
+        print("Worker process died, restarting the workers")
+        self.executor.shutdown(wait=False)
+        self.executor = ProcessPoolExecutor(**self._executor_args)
+        # The resident models of the old workers are gone with them
+        self.worker_models.clear()
+        await self.start()
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True)
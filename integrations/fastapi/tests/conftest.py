@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# The scripts are imported as a package from the project directory, like the
+# app does when it's served with "uvicorn scripts.main:app"
+sys.path.insert(0, str(Path(__file__).parent.parent))
@@ -0,0 +1,87 @@
+import re
+import pytest
+from scripts.chunking import merge_chunk_data, split_text
+
+PARAGRAPH = (
+    "Apple bought a startup in London. Then Google opened an office in Berlin! "
+    "Nobody in Paris noticed?"
+)
+TEXT = "\n\n".join(f"{PARAGRAPH} Part {i}." for i in range(6))
+NAMES = re.compile(r"Apple|Google|London|Berlin|Paris")
+SENTENCES = re.compile(r"[^.!?\s][^.!?]*[.!?]")
+
+
+def annotate(text: str):
+    """Fake model output with character offsets relative to the text."""
+    tokens = [m for m in re.finditer(r"\S+", text)]
+    return {
+        "text": text,
+        "ents": [
+            {"text": m.group(), "label": "X", "start": m.start(), "end": m.end()}
+            for m in NAMES.finditer(text)
+        ],
+        "sents": [
+            {"start": m.start(), "end": m.end()} for m in SENTENCES.finditer(text)
+        ],
+        "tokens": [
+            # Every token is attached to the first token of its chunk
+            {"start": m.start(), "end": m.end(), "head": 0}
+            for m in tokens
+        ],
+    }
+
+
+@pytest.mark.parametrize("max_chars", [20, 50, 120, 500])
+def test_split_text_covers_text(max_chars):
+    chunks = split_text(TEXT, max_chars)
+    assert "".join(chunk for _, chunk in chunks) == TEXT
+    assert all(len(chunk) <= max_chars for _, chunk in chunks)
+    for offset, chunk in chunks:
+        assert TEXT[offset : offset + len(chunk)] == chunk
+
+
+def test_split_text_prefers_paragraphs():
+    chunks = split_text(TEXT, len(PARAGRAPH) + 20)
+    assert len(chunks) == 6
+    assert all(chunk.startswith("Apple") for _, chunk in chunks)
+
+
+def test_split_text_short_text():
+    assert split_text("Short text", 100) == [(0, "Short text")]
+
+
+@pytest.mark.parametrize("max_chars", [50, 120, 500])
+def test_merge_chunk_data_offsets(max_chars):
+    chunks = split_text(TEXT, max_chars)
+    assert len(chunks) > 1
+    merged = merge_chunk_data(
+        TEXT, [(offset, annotate(chunk)) for offset, chunk in chunks]
+    )
+    expected = annotate(TEXT)
+    assert merged["text"] == TEXT
+    assert merged["ents"] == expected["ents"]
+    for ent in merged["ents"]:
+        assert TEXT[ent["start"] : ent["end"]] == ent["text"]
+    assert merged["sents"] == expected["sents"]
+    assert [(t["start"], t["end"]) for t in merged["tokens"]] == [
+        (t["start"], t["end"]) for t in expected["tokens"]
+    ]
+
+
+def test_merge_chunk_data_heads():
+    chunks = split_text(TEXT, 120)
+    merged = merge_chunk_data(
+        TEXT, [(offset, annotate(chunk)) for offset, chunk in chunks]
+    )
+    # The heads point at the first token of each chunk, counted over all tokens
+    first_tokens = []
+    n_tokens = 0
+    for _, chunk in chunks:
+        first_tokens.append(n_tokens)
+        n_tokens += len(chunk.split())
+    assert sorted(set(t["head"] for t in merged["tokens"])) == first_tokens
+
+
+def test_merge_chunk_data_single_chunk():
+    data = annotate(PARAGRAPH)
+    assert merge_chunk_data(PARAGRAPH, [(0, data)]) is data
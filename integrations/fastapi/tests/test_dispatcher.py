@@ -0,0 +1,113 @@
+import asyncio
+from typing import List
+import pytest
+from scripts.dispatcher import BatchDispatcher
+
+
+class Recorder:
+    """Fake model recording the batches it's given."""
+
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.batches: List[List[str]] = []
+        self.delay = delay
+        self.fail = fail
+
+    async def __call__(self, texts: List[str]) -> List[str]:
+        self.batches.append(list(texts))
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("Model failed")
+        return [text.upper() for text in texts]
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_dispatcher_splits_large_requests():
+    model = Recorder()
+    dispatcher = BatchDispatcher(
+        model, max_batch_size=4, max_wait=0.001, max_in_flight=2
+    )
+    texts = [f"text {i}" for i in range(10)]
+
+    async def main():
+        try:
+            return await dispatcher.process(texts)
+        finally:
+            dispatcher.close()
+
+    assert run(main()) == [text.upper() for text in texts]
+    assert all(len(batch) <= 4 for batch in model.batches)
+    assert [text for batch in model.batches for text in batch] == texts
+
+
+def test_dispatcher_splits_by_characters():
+    model = Recorder()
+    dispatcher = BatchDispatcher(
+        model, max_batch_size=100, max_wait=0.001, max_in_flight=1, max_batch_chars=10
+    )
+    texts = ["aaaa", "bbbb", "cccc", "dddddddddddd", "e"]
+
+    async def main():
+        try:
+            return await dispatcher.process(texts)
+        finally:
+            dispatcher.close()
+
+    assert run(main()) == [text.upper() for text in texts]
+    # A text longer than the limit on its own still forms a batch
+    assert model.batches == [["aaaa", "bbbb"], ["cccc"], ["dddddddddddd"], ["e"]]
+
+
+def test_dispatcher_coalesces_concurrent_requests():
+    model = Recorder(delay=0.01)
+    dispatcher = BatchDispatcher(
+        model, max_batch_size=8, max_wait=0.05, max_in_flight=1
+    )
+    requests = [[f"request {i} text {j}" for j in range(i % 3 + 1)] for i in range(12)]
+
+    async def main():
+        try:
+            return await asyncio.gather(*(dispatcher.process(r) for r in requests))
+        finally:
+            dispatcher.close()
+
+    results = run(main())
+    # Every caller gets the results of its own texts, in order
+    assert results == [[text.upper() for text in request] for request in requests]
+    assert len(model.batches) < len(requests)
+    assert all(len(batch) <= 8 for batch in model.batches)
+    status = dispatcher.status()
+    assert status["requests"] == len(requests)
+    assert status["texts"] == sum(len(request) for request in requests)
+    assert status["queued_texts"] == 0
+
+
+def test_dispatcher_empty_request():
+    model = Recorder()
+    dispatcher = BatchDispatcher(
+        model, max_batch_size=4, max_wait=0.001, max_in_flight=1
+    )
+    assert run(dispatcher.process([])) == []
+    assert model.batches == []
+
+
+def test_dispatcher_propagates_errors():
+    model = Recorder(fail=True)
+    dispatcher = BatchDispatcher(
+        model, max_batch_size=4, max_wait=0.001, max_in_flight=1
+    )
+
+    async def main():
+        try:
+            return await dispatcher.process(["a", "b"])
+        finally:
+            dispatcher.close()
+
+    with pytest.raises(RuntimeError):
+        run(main())
@@ -0,0 +1,68 @@
+import json
+import pytest
+from scripts.streaming import JSONStreamDecoder
+
+VALUES = [
+    {"text": "Plain text"},
+    {"text": 'Quotes " and \\ backslashes, a \\" escaped quote'},
+    {"text": "Unicode: caf\u00e9 \u2603 \U0001f600 and a line\nbreak"},
+    {"text": "Brackets ] and braces } inside , a string"},
+]
+
+
+def decode(data: bytes, chunk_size: int):
+    decoder = JSONStreamDecoder()
+    values = []
+    for i in range(0, len(data), chunk_size):
+        values.extend(decoder.feed(data[i : i + chunk_size]))
+    decoder.close()
+    return values
+
+
+def ndjson(values) -> bytes:
+    return "".join(json.dumps(value) + "\n" for value in values).encode("utf8")
+
+
+def array(values) -> bytes:
+    return json.dumps(values, ensure_ascii=False, indent=1).encode("utf8")
+
+
+@pytest.mark.parametrize("encode", [ndjson, array])
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 1000])
+def test_decoder_chunk_boundaries(encode, chunk_size):
+    # With small chunks, the boundaries fall inside strings, escape sequences
+    # and multi-byte characters
+    assert decode(encode(VALUES), chunk_size) == VALUES
+
+
+def test_decoder_non_ascii_ndjson():
+    data = "".join(json.dumps(v, ensure_ascii=False) + "\n" for v in VALUES)
+    for chunk_size in (1, 2, 3):
+        assert decode(data.encode("utf8"), chunk_size) == VALUES
+
+
+def test_decoder_returns_values_as_they_complete():
+    decoder = JSONStreamDecoder()
+    assert decoder.feed(b'{"text": "a"}\n{"text": "b') == [{"text": "a"}]
+    assert decoder.feed(b'\\"c"}\n') == [{"text": 'b"c'}]
+    decoder.close()
+
+
+def test_decoder_empty_streams():
+    assert decode(b"", 10) == []
+    assert decode(b"[]", 1) == []
+    assert decode(b" \n", 1) == []
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b'{"text": "a"}\n{"text": }\n{"text": "b"}\n',
+        b'{"text": "unterminated',
+        b'[{"text": "a"}',
+        b'[{"text": "a"}] {"text": "b"}',
+    ],
+)
+def test_decoder_invalid_input(data):
+    with pytest.raises(ValueError):
+        decode(data, 4)